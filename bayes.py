@@ -1,6 +1,154 @@
+import sys
+import numpy as np
+from collections import OrderedDict, defaultdict
 from util import UndirectedGraph
-from factor import multiply_factors
-from util import compute_elimination_order
+from factor import Factor, BATCH_VARIABLE, multiply_factors, sum_product, shared_axis
+from util import build_moral_graph, elimination_order, elimination_width
+
+
+def batch_likelihoods(evidence_list, domains):
+    """Creates likelihood factors that enter a batch of evidence events at once.
+
+    For each observed variable X, the factor over (BATCH_VARIABLE, X) assigns 1 to the
+    value of X observed in each evidence event, and 0 to the other values. Evidence
+    events in which X is not observed assign 1 to every value.
+
+    Parameters
+    ----------
+    evidence_list : list[dict[str, str]]
+        the evidence events
+    domains : dict[str, list[str]]
+        a dictionary mapping each variable to its possible values
+
+    Returns
+    -------
+    list[Factor]
+        one likelihood factor per observed variable
+    """
+
+    # the batch axis is labeled by a range, which is not interned (see shared_axis)
+    batch_labels = range(len(evidence_list))
+    observed = []
+    for evidence in evidence_list:
+        observed += [var for var in evidence if var not in observed]
+    factors = []
+    for var in observed:
+        labels = tuple(domains[var])
+        table = np.ones((len(evidence_list), len(labels)))
+        for b, evidence in enumerate(evidence_list):
+            if var in evidence:
+                table[b] = [1.0 if val == evidence[var] else 0.0 for val in labels]
+        factors.append(Factor.from_table([BATCH_VARIABLE, var], [batch_labels, labels], table))
+    return factors
+
+
+def split_batch(factor, batch_size):
+    """Splits a factor over BATCH_VARIABLE into one normalized factor per evidence event.
+
+    Parameters
+    ----------
+    factor : Factor
+        a factor whose variables may include BATCH_VARIABLE
+    batch_size : int
+        the number of evidence events in the batch
+
+    Returns
+    -------
+    list[Factor]
+        for each evidence event, the factor (without BATCH_VARIABLE) normalized
+
+    Notes
+    -----
+    Each batch row may carry its own log scale (see Factor.get_log_scale). Normalizing a
+    row divides its scale out, so the rows are read from the table alone.
+    """
+
+    variables = factor.get_variables()
+    if BATCH_VARIABLE not in variables:
+        return [factor.normalize() for _ in range(batch_size)]
+    axis = variables.index(BATCH_VARIABLE)
+    table = np.moveaxis(factor.get_table(), axis, 0)
+    totals = table.reshape(batch_size, -1).sum(axis=1)
+    table = table / totals.reshape((batch_size,) + (1,) * (table.ndim - 1))
+    new_variables = variables[:axis] + variables[axis+1:]
+    labels = factor.get_labels()
+    new_labels = labels[:axis] + labels[axis+1:]
+    return [Factor.from_table(new_variables, new_labels, table[b]) for b in range(batch_size)]
+
+
+class VariableRegistry:
+    """Interns the variables of a Bayesian network and their domain values.
+
+    Each variable is mapped to a dense integer id (in the order of the domains), and each
+    of its values to its position in the variable's domain, which is also the position of
+    the value along the table axis of every factor encoded by the registry. The registry
+    keeps a single copy of each variable name and of each domain, so that encoded factors
+    line up with the products computed by multiply_factors without any relabeling.
+    Parameters
+    ----------
+    domains : dict[str, list[str]]
+        A dictionary mapping each variable to its possible values
+    """
+
+    def __init__(self, domains):
+        self._variables = [sys.intern(var) if isinstance(var, str) else var for var in domains]
+        self._ids = {var: var_id for var_id, var in enumerate(self._variables)}
+        axes = [shared_axis(domains[var]) for var in self._variables]
+        self._labels = [axis_labels for axis_labels, _ in axes]
+        self._index = [index for _, index in axes]
+
+    def __getstate__(self):
+        # the interned names and shared domains are rebuilt in the receiving process
+        return {'domains': dict(zip(self._variables, self._labels))}
+
+    def __setstate__(self, state):
+        self.__init__(state['domains'])
+
+    def __len__(self):
+        return len(self._variables)
+
+    def __contains__(self, var):
+        return var in self._ids
+
+    def get_id(self, var):
+        """Returns the integer id of a variable."""
+        return self._ids[var]
+
+    def get_variable(self, var_id):
+        """Returns the (interned) variable with the given integer id."""
+        return self._variables[var_id]
+
+    def get_labels(self, var):
+        """Returns the domain of a variable, as the shared tuple labeling its factor axes."""
+        return self._labels[self._ids[var]]
+
+    def get_value_id(self, var, value):
+        """Returns the integer id of a value of a variable (its position in the domain)."""
+        return self._index[self._ids[var]][value]
+
+    def encode(self, factor):
+        """Re-encodes a factor onto the interned variables and domains of the registry.
+        Parameters
+        ----------
+        factor : Factor
+            a factor over variables of the registry
+        Returns
+        -------
+        Factor
+            an equivalent factor over the interned variables, whose axes follow the domain
+            order (the given factor itself if it already does, or if it mentions variables
+            unknown to the registry)
+        """
+
+        variables = factor.get_variables()
+        ids = [self._ids.get(var) for var in variables]
+        if None in ids:
+            return factor
+        relabeled = factor.relabel([self._labels[var_id] for var_id in ids])
+        if relabeled is factor:
+            return factor
+        return Factor.from_table([self._variables[var_id] for var_id in ids], relabeled.get_labels(),
+                                 relabeled.get_table(), relabeled.get_log_scale())
 
 
 class BayesianNetwork:
@@ -11,14 +159,33 @@ class BayesianNetwork:
         The factors of the Bayesian network
     domains : dict[str, list[str]]
         A dictionary mapping each variable to its possible values
+    registry : VariableRegistry
+        The registry of a network that this one is derived from (e.g. by eliminate or
+        condition), whose factors are therefore already encoded. By default, a new registry
+        is created for the domains, and the factors are encoded with it.
     """
 
-    def __init__(self, factors, domains):
+    def __init__(self, factors, domains, registry=None):
+        if registry is None:
+            registry = VariableRegistry(domains)
+            factors = [registry.encode(factor) for factor in factors]
+        self._registry = registry
         self._factors = factors
         self._domains = domains
         self._variables = set()
         for factor in self._factors:
-            self._variables = self._variables | set(factor.get_variables())
+            self._variables.update(factor.get_variables())
+        self._cache = None
+        self._cache_size = 0
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_fingerprint = None
+        self._moral_graph = None
+        self._elim_order = None
+        self._structure_fingerprint = None
+        self._heuristic = 'min_degree'
+        self._heuristic_options = dict()
+        self._components = None
 
     def get_variables(self):
         """Returns the set of variables that appear in at least one factor."""
@@ -32,10 +199,219 @@ class BayesianNetwork:
         """Returns the factors of the Bayesian network."""
         return self._factors
 
+    def get_registry(self):
+        """Returns the registry of the variables and values of the Bayesian network."""
+        return self._registry
+
+    def get_moral_graph(self):
+        """Returns the moral graph of the Bayesian network.
+
+        The graph is built on first use and cached until the list of factors changes.
+        """
+        self._check_structure()
+        if self._moral_graph is None:
+            self._moral_graph = build_moral_graph(self)
+        return self._moral_graph
+
+    def get_elimination_order(self, exclude=()):
+        """Returns a low-width elimination order for the Bayesian network.
+
+        The order is computed on first use and cached until the list of factors changes.
+        Parameters
+        ----------
+        exclude : collection[str]
+            variables to leave out of the order (e.g. the query variables)
+        Returns
+        -------
+        list[str]
+            the elimination order, without the excluded variables
+        """
+        self._check_structure()
+        if self._elim_order is None:
+            self._elim_order = elimination_order(self.get_moral_graph(), self._domains,
+                                                 self._heuristic, **self._heuristic_options)
+        if len(exclude) == 0:
+            return list(self._elim_order)
+        exclude = set(exclude)
+        return [var for var in self._elim_order if var not in exclude]
+
+    def set_elimination_heuristic(self, heuristic, **options):
+        """Chooses the heuristic used to compute the elimination order.
+        Parameters
+        ----------
+        heuristic : str
+            one of 'min_degree' (the default), 'min_fill', 'weighted_min_fill' or 'randomized'
+        options : dict
+            extra options for the heuristic (restarts and seed, for 'randomized')
+        """
+        self._heuristic = heuristic
+        self._heuristic_options = options
+        self._elim_order = None
+        self._components = None
+
+    def elimination_report(self):
+        """Reports the cost of variable elimination with the current elimination order.
+        Returns
+        -------
+        dict[str, int]
+            the induced width of the elimination order and the number of entries in
+            its largest clique table
+        """
+        return elimination_width(self.get_moral_graph(), self.get_elimination_order(), self._domains)
+
+    def _check_structure(self):
+        """Discards the cached moral graph and elimination order if the factors changed."""
+        fingerprint = self._factor_fingerprint()
+        if fingerprint != self._structure_fingerprint:
+            self._moral_graph = None
+            self._elim_order = None
+            self._components = None
+            self._structure_fingerprint = fingerprint
+
+    def get_components(self):
+        """Splits the Bayesian network into its connected components.
+
+        Two variables are connected if some factor mentions both of them, so the
+        components of a pedigree are its unrelated families. Evidence about one
+        component has no effect on the variables of another, so each component can be
+        queried on its own. The components are computed on first use and cached until
+        the list of factors changes.
+        Returns
+        -------
+        list[BayesianNetwork]
+            one network per component (the network itself if it is connected)
+        """
+        self._check_structure()
+        if self._components is None:
+            self._components = self._split_components()
+        return self._components
+
+    def _split_components(self):
+        parent = dict()
+
+        def find(var):
+            while parent[var] != var:
+                parent[var] = parent[parent[var]]
+                var = parent[var]
+            return var
+
+        for factor in self._factors:
+            variables = factor.get_variables()
+            for var in variables:
+                parent.setdefault(var, var)
+            for var in variables[1:]:
+                root1, root2 = find(variables[0]), find(var)
+                if root1 != root2:
+                    parent[root2] = root1
+        groups = dict()
+        for factor in self._factors:
+            variables = factor.get_variables()
+            # a factor without variables is a constant, which goes to the first component
+            root = find(variables[0]) if len(variables) > 0 else next(iter(groups), None)
+            groups.setdefault(root, []).append(factor)
+        if len(groups) <= 1:
+            return [self]
+        members = defaultdict(list)
+        for var in parent:
+            members[find(var)].append(var)
+        components = []
+        for root, factors in groups.items():
+            domains = {var: self._domains[var] for var in members[root] if var in self._domains}
+            component = BayesianNetwork(factors, domains, self._registry)
+            component.set_elimination_heuristic(self._heuristic, **self._heuristic_options)
+            components.append(component)
+        return components
+
+    def get_component(self, vars):
+        """Returns the part of the Bayesian network that is connected to the given variables.
+        Parameters
+        ----------
+        vars : collection[str]
+            the variables of interest
+        Returns
+        -------
+        BayesianNetwork
+            the union of the components (see get_components) that contain the variables
+        """
+        components = self.get_components()
+        if len(components) == 1:
+            return self
+        selected = [component for component in components
+                    if any(var in component.get_variables() for var in vars)]
+        if len(selected) == 1:
+            return selected[0]
+        factors = [factor for component in selected for factor in component.get_factors()]
+        domains = dict()
+        for component in selected:
+            domains.update(component.get_domains())
+        return BayesianNetwork(factors, domains, self._registry)
+
+    def enable_cache(self, maxsize=128):
+        """Turns on memoization of compute_marginal and compute_conditional.
+
+        Results are kept in a least-recently-used cache, keyed by the set of query
+        variables and the evidence. The cache is cleared automatically whenever the
+        list of factors changes.
+        Parameters
+        ----------
+        maxsize : int
+            the maximum number of results to keep
+        """
+        self._cache = OrderedDict()
+        self._cache_size = maxsize
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_fingerprint = self._factor_fingerprint()
+
+    def disable_cache(self):
+        """Turns off memoization and discards any cached results."""
+        self._cache = None
+
+    def clear_cache(self):
+        """Discards any cached results (memoization stays enabled)."""
+        if self._cache is not None:
+            self._cache.clear()
+
+    def cache_info(self):
+        """Returns statistics about the result cache.
+        Returns
+        -------
+        dict[str, int]
+            the number of hits and misses, the maximum size and the current size of
+            the cache (all zero if memoization is disabled)
+        """
+        return {'hits': self._cache_hits,
+                'misses': self._cache_misses,
+                'maxsize': self._cache_size if self._cache is not None else 0,
+                'currsize': len(self._cache) if self._cache is not None else 0}
+
+    def _factor_fingerprint(self):
+        return tuple(id(factor) for factor in self._factors)
+
+    def _cached(self, key, compute):
+        """Looks up a result in the cache, computing (and storing) it on a miss."""
+        if self._cache is None:
+            return compute()
+        fingerprint = self._factor_fingerprint()
+        if fingerprint != self._cache_fingerprint:
+            self._cache.clear()
+            self._cache_fingerprint = fingerprint
+        if key in self._cache:
+            self._cache_hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self._cache_misses += 1
+        result = compute()
+        self._cache[key] = result
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return result
+
     def eliminate(self, variable):
         """Eliminates a variable from the Bayesian network.
         By "eliminate", we mean that the factors containing the variable are multiplied,
-        and then the variable is marginalized (summed) out of the resulting factor.
+        and then the variable is marginalized (summed) out of the resulting factor
+        (both at once, see sum_product).
         Parameters
         ----------
         variable : str
@@ -59,10 +435,10 @@ class BayesianNetwork:
             else:
                 not_contained_factors.append(factor)
                 
-        # multiply factors containing the variable we are eliminating
-        multiplied_factor = multiply_factors(contained_factors, self._domains)
-        # marginalize variable out of the multiplied factor
-        marginalized_factor = multiplied_factor.marginalize(variable)
+        # multiply factors containing the variable we are eliminating, and marginalize
+        # the variable out of the product (without materializing the product)
+        kept = {var for factor in contained_factors for var in factor.get_variables()} - {variable}
+        marginalized_factor = sum_product(contained_factors, self._domains, kept)
         #rebuild the list of factors in the Bayesian Network
         not_contained_factors.append(marginalized_factor)
         
@@ -72,26 +448,130 @@ class BayesianNetwork:
             if i is not variable:
                 new_domains[i] = self._domains[i]
         
-        return BayesianNetwork(not_contained_factors, new_domains)
+        return BayesianNetwork(not_contained_factors, new_domains, self._registry)
 
 
-    def compute_marginal(self, vars):
+    def prune(self, vars, evidence=None):
+        """Removes the factors that are irrelevant to a query.
+        First, barren variables are removed: an unqueried variable that appears in a
+        single factor, which sums to one over that variable (i.e. the factor is the
+        variable's CPT), can be summed out by simply dropping the factor. This is
+        repeated until no barren variables remain.
+        If evidence is given, it is entered into the factors first, and afterwards
+        every factor that is not connected to the query variables through unobserved
+        variables is also removed. Given the evidence, such factors are d-separated
+        from the query and only contribute a constant, so the pruned network is only
+        correct up to normalization.
+        Parameters
+        ----------
+        vars : collection[str]
+            the query variables
+        evidence : dict[str, str]
+            the observed event (or None)
+        Returns
+        -------
+        BayesianNetwork
+            a new BayesianNetwork containing only the relevant factors
+        """
+        bnet = self.condition(evidence) if evidence is not None else self
+        factors = bnet.get_factors()
+        keep = set(vars)
+        occurrences = defaultdict(set)
+        for i, factor in enumerate(factors):
+            for var in factor.get_variables():
+                occurrences[var].add(i)
+        removed = set()
+        candidates = [var for var in occurrences if var not in keep]
+        while len(candidates) > 0:
+            var = candidates.pop()
+            if len(occurrences[var]) != 1:
+                continue
+            i = next(iter(occurrences[var]))
+            factor = factors[i]
+            # a query variable must keep at least one factor (e.g. a variable without a
+            # CPT of its own, which only appears in its children's CPTs)
+            if any(other in keep and len(occurrences[other]) == 1 for other in factor.get_variables()):
+                continue
+            total = factor.get_table().sum(axis=factor.get_variables().index(var))
+            if not np.allclose(total * np.exp(factor.get_log_scale()), 1.0):
+                continue
+            removed.add(i)
+            for other in factor.get_variables():
+                occurrences[other].discard(i)
+                if other not in keep and len(occurrences[other]) == 1:
+                    candidates.append(other)
+        if evidence is not None:
+            # keep the factors that can be reached from a query variable through shared variables
+            reached_vars = set(var for var in keep if var in occurrences)
+            frontier = list(reached_vars)
+            reached = set()
+            while len(frontier) > 0:
+                for i in occurrences[frontier.pop()]:
+                    if i not in reached:
+                        reached.add(i)
+                        for other in factors[i].get_variables():
+                            if other not in reached_vars:
+                                reached_vars.add(other)
+                                frontier.append(other)
+            removed |= set(range(len(factors))) - reached
+        kept = [factor for i, factor in enumerate(factors) if i not in removed]
+        return BayesianNetwork(kept, bnet.get_domains(), self._registry)
+
+    def compute_marginal(self, vars, prune=False):
         """Computes the marginal probability over the specified variables.
         This method uses variable elimination to compute the marginal distribution.
         Parameters
         ----------
         vars : set[str]
             the variables that we want to compute the marginal over
+        prune : bool
+            if True, barren variables are removed before elimination (see prune)
         """
 
-        elim_order, _ = compute_elimination_order(self)
+        vars = list(vars)
+        return self._cached(('marginal', frozenset(vars)),
+                            lambda: self._compute_marginal(vars, prune))
+
+    def _compute_marginal(self, vars, prune=False):
+        bnet = self.prune(vars) if prune else self
+        return bnet._eliminate_all(self.get_elimination_order(exclude=vars))
+
+    def _eliminate_all(self, elim_order):
+        """Eliminates the variables of this network that appear in elim_order (in that order),
+        and multiplies the remaining factors."""
         bnet = self
-        revised_elim_order = [var for var in elim_order if var not in vars]
-        for var in revised_elim_order:
-            bnet = bnet.eliminate(var)
+        variables = self.get_variables()
+        for var in elim_order:
+            if var in variables:
+                bnet = bnet.eliminate(var)
         return multiply_factors(bnet.get_factors(), bnet.get_domains())
 
-    def compute_conditional(self, vars, evidence):
+    def condition(self, evidence):
+        """Enters evidence into the Bayesian network.
+        Every factor that mentions an observed variable is reduced by the evidence, and
+        the observed variables are then dropped from the factors and the domains.
+        Parameters
+        ----------
+        evidence : dict[str, str]
+            the observed event
+        Returns
+        -------
+        BayesianNetwork
+            a new BayesianNetwork over the unobserved variables, whose factors multiply
+            to the joint probability of those variables and the evidence
+        """
+        factors = []
+        for factor in self._factors:
+            observed = [var for var in factor.get_variables() if var in evidence]
+            if len(observed) > 0:
+                factor = factor.reduce(evidence)
+                for var in observed:
+                    factor = factor.marginalize(var)
+            factors.append(factor)
+        domains = {var: self._domains[var] for var in self._domains if var not in evidence}
+        return BayesianNetwork(factors, domains, self._registry)
+
+    def compute_conditional(self, vars, evidence, evidence_first=True, prune=False):
         """Computes the conditional distibution over a set of variables given an evidence event.
         Parameters
         ----------
@@ -99,18 +579,77 @@ class BayesianNetwork:
             the variables that we want to compute the probability distribution over
         evidence : dict[str, str]
             the observed event
+        evidence_first : bool
+            if True, the evidence is entered into every factor before elimination, so the
+            observed variables never appear in intermediate factors; if False, the
+            marginal over the query and evidence variables is computed first and then
+            reduced by the evidence
+        prune : bool
+            if True, barren variables and factors that are d-separated from the query
+            variables are removed before elimination (see prune)
         Returns
         -------
         float
             the conditional probability of the event according to the Bayesian network
         """
 
+        vars = list(vars)
+        return self._cached(('conditional', frozenset(vars), frozenset(evidence.items())),
+                            lambda: self._compute_conditional(vars, evidence, evidence_first, prune))
+
+    def _compute_conditional(self, vars, evidence, evidence_first, prune):
+        # evidence about other components does not change the distribution of vars
+        component = self.get_component(vars)
+        if component is not self:
+            variables = component.get_variables()
+            evidence = {var: val for var, val in evidence.items() if var in variables}
+        if evidence_first:
+            bnet = component.prune(vars, evidence) if prune else component.condition(evidence)
+            # the cached order of this network still works once the observed variables are dropped
+            elim_order = component.get_elimination_order(exclude=set(vars) | set(evidence))
+            return bnet._eliminate_all(elim_order).normalize()
         all_vars = list(vars) + list(evidence.keys())
-        marginal = self.compute_marginal(all_vars)
+        marginal = component._compute_marginal(all_vars, prune)
         marginal = marginal.reduce(evidence)
         for var in evidence:
             marginal = marginal.marginalize(var)
         return marginal.normalize()
 
+    def compute_conditional_batch(self, vars, evidence_list):
+        """Computes the conditional distribution over a set of variables for each of several evidence events.
+        The evidence events are entered as likelihood factors over an extra variable
+        (BATCH_VARIABLE) that indexes the batch, so a single variable elimination, with
+        the cached elimination order, handles the whole batch.
+        Parameters
+        ----------
+        vars : list[str]
+            the variables that we want to compute the probability distribution over
+        evidence_list : list[dict[str, str]]
+            the observed events
+        Returns
+        -------
+        list[Factor]
+            the conditional distribution for each evidence event (in the same order)
+        """
+
+        vars = list(vars)
+        if len(evidence_list) == 0:
+            return []
+        domains = dict(self._domains)
+        domains[BATCH_VARIABLE] = range(len(evidence_list))
+        bnet = BayesianNetwork(self._factors + batch_likelihoods(evidence_list, self._domains), domains)
+        joint = bnet._eliminate_all(self.get_elimination_order(exclude=vars))
+        return split_batch(joint, len(evidence_list))
+
+    def __getstate__(self):
+        # cached results are not worth shipping to other processes, and the cached
+        # structure is keyed by the ids of the factors, which do not survive unpickling
+        state = dict(self.__dict__)
+        if state['_cache'] is not None:
+            state['_cache'] = OrderedDict()
+        for name in ('_cache_fingerprint', '_moral_graph', '_elim_order', '_structure_fingerprint', '_components'):
+            state[name] = None
+        return state
+
     def __str__(self):
         return '\n\n'.join([str(factor) for factor in self._factors])
\ No newline at end of file
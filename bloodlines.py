@@ -3,7 +3,7 @@ import os
 import pygame as pg
 import threading
 from bayes import BayesianNetwork
-from inference import run_inference
+from inference import run_inference, CompiledNetwork
 from genetics import Male, Female, create_family_bayes_net
 from graphics import CartesianPlane, AnimatedSprite, Console
 from graphics import RainbowOverlay, FamilyMemberWidget
@@ -25,6 +25,7 @@ class VictoriaBloodlines:
         self.console = Console(17.4, 3.6, scale=0.3)
         self.plane.add_sprite(self.console)
         self.bnet = create_family_bayes_net(family)
+        self.compiled_bnet = CompiledNetwork(self.bnet)
         self.running_bp = False
         self.marginals = dict()
 
@@ -77,7 +78,7 @@ class VictoriaBloodlines:
 
     def run_inference(self, evidence):
         self.running_bp = True
-        marginals = run_inference(self.bnet, evidence)
+        marginals = run_inference(self.compiled_bnet, evidence)
         for person in self.family_widgets:
             if person.get_color() not in [(255, 0, 0), (0, 255, 0)]:
                 try:
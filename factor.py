@@ -1,9 +1,34 @@
 from collections import defaultdict
+from functools import lru_cache
 from xml import dom
+import numpy as np
+
+
+# The variable that indexes the evidence events of a batched query (see
+# bayes.batch_likelihoods). Its axis is labeled by range(batch size).
+BATCH_VARIABLE = '#batch'
 
 
 class Factor:
-    """A factor in a Bayesian network (i.e. a multivariable function)"""
+    """A factor in a Bayesian network (i.e. a multivariable function)
+
+    The factor is stored densely as a NumPy array with one axis per variable.
+    Each axis is labeled by a tuple of domain values, so that the integer
+    position along an axis encodes a domain value of the corresponding variable.
+
+    To avoid underflow in long products, a factor also carries a scaling exponent:
+    the value of an event is its table entry multiplied by exp(log_scale). A factor
+    over BATCH_VARIABLE may instead carry one exponent per batch row (a vector indexed
+    by the row), since the evidence events of a batch can differ in probability by far
+    more than a single table can represent.
+
+    Factors are never modified in place, so their tables, axis labels and value
+    indexes can be shared: factors with the same axis labels share one label tuple
+    and index, and factors created from the same table (e.g. the CPTs of a large
+    pedigree) share its storage.
+    """
+
+    __slots__ = ('_variables', '_labels', '_index', '_table', '_log_scale')
 
     def __init__(self, variables, values):
         """
@@ -15,9 +40,56 @@ class Factor:
             A dictionary mapping each event (expressed as a tuple) to its value
         """
 
+        labels = [[] for _ in variables]
+        index = [dict() for _ in variables]
+        for event in values:
+            for axis, val in enumerate(event):
+                if val not in index[axis]:
+                    index[axis][val] = len(labels[axis])
+                    labels[axis].append(val)
+        table = np.zeros(tuple(len(axis_labels) for axis_labels in labels))
+        for event, value in values.items():
+            table[tuple(index[axis][val] for axis, val in enumerate(event))] = value
         self._variables = variables
-        self._values = values
-    
+        self._set_labels(labels)
+        self._table = table
+        self._log_scale = 0.0
+
+    @classmethod
+    def from_table(cls, variables, labels, table, log_scale=0.0):
+        """Creates a factor directly from a dense table.
+
+        Parameters
+        ----------
+        variables : list[str]
+            The variables of the factor
+        labels : list[tuple[str]]
+            For each variable, the domain values labeling the corresponding table axis
+        table : numpy.ndarray
+            An array with one axis per variable, holding the value of each event
+        log_scale : float or numpy.ndarray
+            The scaling exponent (the values of the factor are table * exp(log_scale)),
+            or one exponent per batch row if the factor is over BATCH_VARIABLE
+
+        Returns
+        -------
+        Factor
+            The factor described by the table.
+        """
+
+        factor = cls.__new__(cls)
+        factor._variables = variables
+        factor._set_labels(labels)
+        factor._table = table
+        factor._log_scale = log_scale
+        return factor
+
+    def _set_labels(self, labels):
+        """Sets the axis labels of the factor, along with their (shared) value indexes."""
+        axes = [shared_axis(axis_labels) for axis_labels in labels]
+        self._labels = [axis_labels for axis_labels, _ in axes]
+        self._index = [index for _, index in axes]
+
     def get_variables(self):
         """Returns the variables of the factor.
         Returns
@@ -28,6 +100,61 @@ class Factor:
 
         return self._variables
 
+    def get_labels(self):
+        """Returns the domain values labeling each axis of the factor's table.
+        Returns
+        -------
+        list[tuple[str]]
+            For each variable, the domain values in the order of the table axis.
+        """
+
+        return self._labels
+
+    def get_table(self):
+        """Returns the dense table of the factor.
+        The values of the factor are the entries of the table multiplied by
+        exp(get_log_scale()).
+        Returns
+        -------
+        numpy.ndarray
+            An array with one axis per variable (in the order of get_variables).
+        """
+
+        return self._table
+
+    def get_log_scale(self):
+        """Returns the scaling exponent of the factor (see get_table).
+
+        For a factor over BATCH_VARIABLE, this may be a vector with one exponent per batch row.
+        """
+
+        return self._log_scale
+
+    def rescale(self):
+        """Moves the magnitude of the table into the scaling exponent.
+        Returns
+        -------
+        Factor
+            An equivalent Factor whose largest table entry is one (unless all entries are
+            zero), or whose largest entry in each batch row is one (for a factor over
+            BATCH_VARIABLE).
+        """
+
+        table, extra_scale = _rescale_table(self._table, self._batch_axis(), np.inf)
+        if table is self._table:
+            return self
+        return Factor.from_table(self._variables, self._labels, table, self._log_scale + extra_scale)
+
+    def _batch_axis(self):
+        """Returns the axis of BATCH_VARIABLE (or None if the factor is not over it)."""
+        return self._variables.index(BATCH_VARIABLE) if BATCH_VARIABLE in self._variables else None
+
+    def _scale_at(self, key):
+        """Returns the scaling exponent of a table entry."""
+        if np.ndim(self._log_scale) == 0:
+            return self._log_scale
+        return self._log_scale[key[self._batch_axis()]]
+
     def get_value(self, event):
         """Returns the value that the factor assigns to a particular event.
         Returns
@@ -40,15 +167,36 @@ class Factor:
             If the factor has no value assigned to the given event.
         """
 
+        key = self._key(event)
+        return float(self._table[key] * np.exp(self._scale_at(key)))
+
+    def get_log_value(self, event):
+        """Returns the natural logarithm of the value that the factor assigns to an event.
+        Unlike get_value, this does not underflow for factors with a very small scale.
+        Returns
+        -------
+        float
+            The log of the value associated with the event (-inf if the value is zero)
+        Raises
+        ------
+        KeyError
+            If the factor has no value assigned to the given event.
+        """
+
+        key = self._key(event)
+        with np.errstate(divide='ignore'):
+            return float(np.log(self._table[key]) + self._scale_at(key))
+
+    def _key(self, event):
+        """Converts an event into the index of its table entry."""
         key = []
-        for var in self._variables:
+        for axis, var in enumerate(self._variables):
             if var not in event:
                 raise KeyError(f'Variable {var} not found in given event.')
-            key.append(event[var])
-        if tuple(key) in self._values:
-            return self._values[tuple(key)]
-        else:
-            raise KeyError(f'No value assigned to event {event}.')
+            if event[var] not in self._index[axis]:
+                raise KeyError(f'No value assigned to event {event}.')
+            key.append(self._index[axis][event[var]])
+        return tuple(key)
 
     def normalize(self):
         """Normalizes the event values.
@@ -61,17 +209,11 @@ class Factor:
             are normalized.
         """
         # question two
-        #get the sum of all possible values
-        total_val = 0
-        for i in self._values:
-            total_val += self._values[i]
-        new_values = {}
-        #normalize the values
-        for i in self._values:
-            normalized_val = (self._values[i] / total_val)
-            new_values[i] = normalized_val
-
-        return Factor(self._variables, new_values)    
+        table = self._table
+        if np.ndim(self._log_scale) > 0 and self._log_scale.size > 0:
+            # bring the batch rows to a common scale first
+            table = table * _scale_vector(self._log_scale - self._log_scale.max(), self._batch_axis(), table.ndim)
+        return Factor.from_table(self._variables, self._labels, table / table.sum())
 
     def reduce(self, evidence):
         """Removes any events in the factor that do not agree with the "evidence" event.
@@ -84,7 +226,7 @@ class Factor:
             {'P': 'yes', 'D': 'n', 'R': '+'}
             {'P': 'yes', 'D': 's', 'T': '-'}
         do not agree, since the variable 'D' is associated with different values in the
-        events.
+        events. Evidence about variables that are not in the factor is ignored.
         Parameters
         ----------
         evidence : dict[str, str]
@@ -96,18 +238,18 @@ class Factor:
             with the evidence event are removed.
         """
         # question two
-        new_values = {}
-        for i in self._values:
-            flag = True
-            for j in evidence:
-                index = self._variables.index(j)
-                if evidence[j] != i[index]:
-                    flag = False
-                    break 
-            if flag:
-                # keep the event that does not disagree with the "evidence" event
-                new_values[i] = self._values[i]                                      
-        return Factor(self._variables, new_values)
+        labels = list(self._labels)
+        table = self._table
+        log_scale = self._log_scale
+        for axis, var in enumerate(self._variables):
+            if var in evidence:
+                # slice the axis down to the observed value (or to nothing at all)
+                kept = [self._index[axis][evidence[var]]] if evidence[var] in self._index[axis] else []
+                labels[axis] = tuple(labels[axis][i] for i in kept)
+                table = np.take(table, kept, axis=axis)
+                if var == BATCH_VARIABLE and np.ndim(log_scale) > 0:
+                    log_scale = log_scale[kept]
+        return Factor.from_table(self._variables, labels, table, log_scale)
 
     def marginalize(self, variable):
         """Marginalizes (sums) out the specified variable.
@@ -122,33 +264,93 @@ class Factor:
             marginalized out.
         """
         # question two
-        new_variables = []
-        # remove the marginalized variable
-        for i in range(len(self._variables)):
-            if self._variables[i] != variable:
-                new_variables.append(self._variables[i])
-        
-        new_values = {}
-        index = self._variables.index(variable)
-        
-        for i in self._values: 
-            new_key = i[:index] + i[index+1:]
-            if new_key not in new_values:
-                # keep values of events that do not include the marginalized variable the same
-                new_values[new_key] = self._values[i]
-            else:
-                # sums out the specified variable
-                new_values[new_key] += self._values[i]
-        return Factor(new_variables, new_values)
+        axis = self._variables.index(variable)
+        new_variables = self._variables[:axis] + self._variables[axis+1:]
+        new_labels = self._labels[:axis] + self._labels[axis+1:]
+        table = self._table
+        log_scale = self._log_scale
+        if variable == BATCH_VARIABLE and np.ndim(log_scale) > 0:
+            # the batch rows are summed, so they are brought to a common scale first
+            peak = log_scale.max() if log_scale.size > 0 else 0.0
+            table = table * _scale_vector(log_scale - peak, axis, table.ndim)
+            log_scale = float(peak)
+        return Factor.from_table(new_variables, new_labels, table.sum(axis=axis), log_scale)
+
+    def relabel(self, labels):
+        """Relabels the axes of the factor with the given domain values.
+        Events of the factor with values missing from the given labels are dropped,
+        and events with values that the factor has no entry for are given zero.
+        Parameters
+        ----------
+        labels : list[tuple[str]]
+            For each variable, the domain values that should label its table axis
+        Returns
+        -------
+        Factor
+            An equivalent Factor whose table axes follow the given labels (the current
+            Factor itself if they already do).
+        """
+
+        labels = [shared_axis(axis_labels)[0] for axis_labels in labels]
+        if all(old is new for old, new in zip(self._labels, labels)):
+            return self
+        positions = {var: axis for axis, var in enumerate(self._variables)}
+        table, _ = _align_table(self, positions, labels)
+        return Factor.from_table(self._variables, labels, table, self._log_scale)
+
+    def __getstate__(self):
+        # the value index is rebuilt from the labels when unpickling
+        return {'variables': self._variables, 'labels': self._labels,
+                'table': self._table, 'log_scale': self._log_scale}
+
+    def __setstate__(self, state):
+        self._variables = state['variables']
+        self._set_labels(state['labels'])
+        self._table = state['table']
+        self._log_scale = state['log_scale']
 
     def __str__(self):
         result = f"{self._variables}:"
-        for event, value in self._values.items():
-            result += f"\n  {event}: {value}"
+        for key in np.ndindex(*self._table.shape):
+            event = tuple(self._labels[axis][i] for axis, i in enumerate(key))
+            result += f"\n  {event}: {self._table[key] * np.exp(self._scale_at(key))}"
         return result
 
     __repr__ = __str__
 
+# The label tuple and value index of every distinct axis, shared by all factors
+# (see shared_axis), keyed by the labels and by the id of the shared label tuple.
+_AXES = dict()
+_AXES_BY_ID = dict()
+
+
+def shared_axis(axis_labels):
+    """Returns the shared copy of an axis' labels, along with its value index.
+    Every factor (and VariableRegistry) with the same labels uses this copy, so the
+    index must never be modified. An axis labeled by range(n) (i.e. the batch axis,
+    whose size changes from batch to batch) is not shared: the range is its own index.
+
+    Returns
+    -------
+    (tuple[str], dict[str, int])
+        the labels, and a dictionary mapping each label to its position on the axis
+    """
+
+    if isinstance(axis_labels, range) and axis_labels.start == 0 and axis_labels.step == 1:
+        return axis_labels, axis_labels
+    # shared label tuples are never freed, so their ids stay valid
+    axis = _AXES_BY_ID.get(id(axis_labels))
+    if axis is not None:
+        return axis
+    axis_labels = tuple(axis_labels)
+    axis = _AXES.get(axis_labels)
+    if axis is None:
+        axis = (axis_labels, {val: i for i, val in enumerate(axis_labels)})
+        _AXES[axis_labels] = axis
+        _AXES_BY_ID[id(axis_labels)] = axis
+    return axis
+
+
 # recursive method that helps to build the list for events
 def events_helper(i, vars, domains, cur_list):
     if i == len(vars):
@@ -187,7 +389,22 @@ def events(vars, domains):
     returned_events = events_helper(0, vars, domains, [])
     return returned_events  
 
-def multiply_factors(factors, domains):
+# A product is computed sparsely when the expected fraction of nonzero entries in the
+# result falls below this threshold (and the result has at least SPARSE_MIN_SIZE entries).
+SPARSE_DENSITY_THRESHOLD = 0.1
+SPARSE_MIN_SIZE = 1024
+# A product is rescaled automatically when its largest entry falls below this value.
+RESCALE_THRESHOLD = 1e-100
+# The largest number of variables and of factors that sum_product contracts with
+# numpy.einsum, which has 52 subscripts (a-z and A-Z); longer products are multiplied
+# one factor at a time, so that the running product can be rescaled.
+EINSUM_MAX_AXES = 52
+EINSUM_MAX_OPERANDS = 32
+# Contractions of up to this many factors are planned by an exhaustive search (which
+# is exponential in the number of factors), and larger ones greedily.
+OPTIMAL_PLAN_MAX_OPERANDS = 4
+
+def multiply_factors(factors, domains, sparse=None, rescale=None):
     """Multiplies a list of factors.
     Parameters
     ----------
@@ -195,12 +412,170 @@ def multiply_factors(factors, domains):
         The factors to multiply
     domains : dict[str, list[str]]
         A dictionary mapping each variable to its possible values
+    sparse : bool
+        If True, only the nonzero entries of the factors are joined, so the full
+        cross product of the domains is never enumerated. If False, the product is
+        computed densely by broadcasting. If None (the default), the mode is chosen
+        from the density of the factors.
+    rescale : bool
+        If True, the magnitude of the product is always moved into its scaling
+        exponent (see Factor.rescale). If False, it never is. If None (the default),
+        this only happens when the largest entry of the product is tiny.
     Returns
     -------
     Factor
         The product of the input factors.
     """
     # question three
+    new_variables, new_labels, aligned = _align_factors(factors, domains)
+    shape = tuple(len(axis_labels) for axis_labels in new_labels)
+    batch = new_variables.index(BATCH_VARIABLE) if BATCH_VARIABLE in new_variables else None
+    if sparse is None:
+        sparse = _prefer_sparse(aligned, shape)
+    log_scale = sum(f._log_scale for f in factors)
+    if sparse:
+        table, extra_scale = _sparse_product(aligned, shape, rescale is not False, batch=batch)
+    else:
+        table, extra_scale = _dense_product(aligned, shape, rescale is not False, batch)
+    product = Factor.from_table(new_variables, new_labels, table, log_scale + extra_scale)
+    return product.rescale() if rescale else product
+
+
+def sum_product(factors, domains, variables, sparse=None):
+    """Multiplies a list of factors and sums out every variable except the specified ones.
+
+    Unlike multiply_factors followed by marginalize, the factors are contracted directly
+    onto the kept variables (by numpy.einsum, with one integer subscript per variable),
+    so the product over all the variables is never materialized. The factors are
+    contracted two at a time, in the order planned by contraction_plan. Products that
+    multiply_factors would join sparsely are joined the same way, but the joined
+    entries are summed directly onto the kept variables. Products with more variables
+    or factors than einsum supports (EINSUM_MAX_AXES, EINSUM_MAX_OPERANDS) are still
+    multiplied first and then summed.
+
+    Parameters
+    ----------
+    factors : list[Factor]
+        The factors to multiply
+    domains : dict[str, list[str]]
+        A dictionary mapping each variable to its possible values
+    variables : set[str]
+        The variables to keep
+    sparse : bool
+        Whether the product is joined sparsely (see multiply_factors)
+    Returns
+    -------
+    Factor
+        The product of the input factors, marginalized onto the specified variables
+        (in the order they appear in the product).
+    """
+
+    new_variables, new_labels, aligned = _align_factors(factors, domains)
+    shape = tuple(len(axis_labels) for axis_labels in new_labels)
+    kept = [pos for pos, var in enumerate(new_variables) if var in variables]
+    batch = new_variables.index(BATCH_VARIABLE) if BATCH_VARIABLE in new_variables else None
+    if batch is not None and batch not in kept:
+        # the batch rows may have different scales, which Factor.marginalize reconciles
+        kept_with_batch = set(variables) | {BATCH_VARIABLE}
+        return sum_product(factors, domains, kept_with_batch, sparse).marginalize(BATCH_VARIABLE)
+    if sparse is None:
+        sparse = _prefer_sparse(aligned, shape)
+    log_scale = sum(f._log_scale for f in factors)
+    if sparse:
+        table, extra_scale = _sparse_product(aligned, shape, True, kept, batch)
+    elif not 0 < len(factors) <= EINSUM_MAX_OPERANDS or len(shape) > EINSUM_MAX_AXES:
+        table, extra_scale = _dense_product(aligned, shape, True, batch)
+        table = table.sum(axis=tuple(pos for pos in range(len(shape)) if pos not in kept))
+    else:
+        tables = []
+        for f_table, positions in aligned:
+            # the partial products cannot be rescaled, so the inputs are (to a peak of one)
+            f_table, extra_scale = _rescale_table(f_table, positions.index(batch) if batch in positions else None,
+                                                  np.inf)
+            log_scale = log_scale + extra_scale
+            tables.append(f_table)
+        subscripts = tuple(tuple(positions) for _, positions in aligned)
+        if len(tables) <= 2:
+            # a product of two factors is a single contraction, which needs no plan
+            table = np.einsum(*[arg for pair in zip(tables, subscripts) for arg in pair], kept)
+        else:
+            table = _contract(tables, subscripts, contraction_plan(subscripts, shape, tuple(kept)))
+        table, extra_scale = _rescale_table(np.asarray(table), kept.index(batch) if batch is not None else None,
+                                            RESCALE_THRESHOLD)
+    return Factor.from_table([new_variables[pos] for pos in kept], [new_labels[pos] for pos in kept],
+                             table, log_scale + extra_scale)
+
+
+@lru_cache(maxsize=4096)
+def contraction_plan(subscripts, shape, output):
+    """Plans the order in which sum_product contracts its factors, two at a time.
+
+    The order is found by numpy.einsum_path. The plan only depends on the structure of
+    the product, so it is cached: products with the same variable positions and domain
+    sizes (e.g. the messages of every member of a pedigree) reuse it.
+
+    Parameters
+    ----------
+    subscripts : tuple[tuple[int]]
+        for each factor, the positions of its variables in the product
+    shape : tuple[int]
+        the domain size of the variable at each position
+    output : tuple[int]
+        the positions of the variables to keep
+    Returns
+    -------
+    tuple[(tuple[int], tuple[int])]
+        the steps of the contraction: each step removes the operands at the given
+        indexes (in that order) from the list of operands, and appends their
+        contraction onto the given positions (see _contract)
+    """
+
+    operands = []
+    for positions in subscripts:
+        # the planner only looks at the shapes, so the operands take no memory
+        operands += [np.broadcast_to(np.empty(()), tuple(shape[pos] for pos in positions)), list(positions)]
+    strategy = 'optimal' if len(subscripts) <= OPTIMAL_PLAN_MAX_OPERANDS else 'greedy'
+    path = np.einsum_path(*operands, list(output), optimize=strategy)[0][1:]
+    remaining = list(subscripts)
+    steps = []
+    for contraction in path:
+        indexes = tuple(sorted(contraction, reverse=True))
+        contracted = [remaining.pop(index) for index in indexes]
+        if len(remaining) == 0:
+            result = tuple(output)
+        else:
+            # an intermediate result keeps the variables that are needed later on
+            needed = set(output).union(*remaining)
+            result = tuple(sorted({pos for positions in contracted for pos in positions} & needed))
+        remaining.append(result)
+        steps.append((indexes, result))
+    return tuple(steps)
+
+
+def _contract(operands, subscripts, plan):
+    """Contracts aligned tables by following a plan (see contraction_plan)."""
+    operands = list(operands)
+    subscripts = list(subscripts)
+    for indexes, result in plan:
+        arguments = []
+        for index in indexes:
+            arguments += [operands.pop(index), subscripts.pop(index)]
+        # numpy.einsum (without its optimize argument) contracts in a single pass of C code
+        operands.append(np.einsum(*arguments, list(result)))
+        subscripts.append(result)
+    return operands[0]
+
+
+def _align_factors(factors, domains):
+    """Aligns the tables of a list of factors with the union of their variables.
+
+    Returns
+    -------
+    (list[str], list[tuple[str]], list[(numpy.ndarray, list[int])])
+        the variables of the product (in order of appearance), their axis labels, and
+        each factor's aligned table and axis positions (see _align_table)
+    """
+
     new_variables = []
     # unionize the variables of all the factors
     for f in factors:
@@ -208,25 +583,219 @@ def multiply_factors(factors, domains):
             if v not in new_variables:
                 new_variables.append(v)
 
-    new_values = {}
-    list_events = events(new_variables, domains)
-    
-    for i in list_events:
-        val = 1
-        for f in factors:            
-            k = []
-            for var in f._variables:
-                # get the value for each variable in the current factor in event i
-                k.append(i[var])
-            
-            new_key = tuple(k)
-            if new_key in f._values:
-                # multiply by the value associated with with event i in the current factor
-                val *= f._values[new_key]
-            else: 
-                val = 0
-        #assign the value to the dictionary "new_values"
-        values = tuple(i.values())
-        new_values[values] = val
-
-    return Factor(new_variables, new_values)    
\ No newline at end of file
+    # the shared label tuples let _align_table recognize factors that are already aligned
+    new_labels = [shared_axis(domains[v])[0] for v in new_variables]
+    positions = {v: pos for pos, v in enumerate(new_variables)}
+    return new_variables, new_labels, [_align_table(f, positions, new_labels) for f in factors]
+
+
+def _prefer_sparse(aligned, shape):
+    """Decides whether a product is joined sparsely, from the density of its factors."""
+    density = 1.0
+    for table, _ in aligned:
+        density *= np.count_nonzero(table) / max(table.size, 1)
+    return density < SPARSE_DENSITY_THRESHOLD and np.prod(shape) >= SPARSE_MIN_SIZE
+
+
+def _dense_product(aligned, shape, rescale, batch=None):
+    """Multiplies aligned tables by broadcasting them against the shape of the product.
+
+    Returns
+    -------
+    (numpy.ndarray, float or numpy.ndarray)
+        the product table, and the log of the scale that was factored out of it
+        (always zero unless rescale is True; one value per batch row if batch, the
+        position of BATCH_VARIABLE, is given)
+    """
+
+    table = np.ones(shape)
+    log_scale = 0.0
+    for f_table, positions in aligned:
+        table = table * _broadcast(f_table, positions, shape)
+        if rescale:
+            # keep the running product away from underflow
+            table, extra_scale = _rescale_table(table, batch, RESCALE_THRESHOLD)
+            log_scale = log_scale + extra_scale
+    return table, log_scale
+
+
+def _rescale_if_tiny(values):
+    """Divides an array by its largest entry if that entry is below RESCALE_THRESHOLD.
+
+    Returns
+    -------
+    (numpy.ndarray, float)
+        the (possibly) rescaled array, and the log of the factor it was divided by
+    """
+
+    return _rescale_table(values, None, RESCALE_THRESHOLD)
+
+
+def _rescale_table(table, batch_axis, threshold):
+    """Divides a table by its largest entry, if that entry is positive and below threshold.
+
+    If the table has a batch axis, each batch row is divided by its own largest entry
+    instead, so that a row never underflows because another row is much larger.
+
+    Returns
+    -------
+    (numpy.ndarray, float or numpy.ndarray)
+        the (possibly) rescaled table, and the log of what it was divided by (one value
+        per batch row if there is a batch axis, unless no row was rescaled)
+    """
+
+    if batch_axis is None or table.size == 0:
+        peak = table.max() if table.size > 0 else 0.0
+        if np.isfinite(peak) and 0.0 < peak < threshold and peak != 1.0:
+            return table / peak, float(np.log(peak))
+        return table, 0.0
+    peaks = table.max(axis=tuple(axis for axis in range(table.ndim) if axis != batch_axis))
+    peaks = np.where(np.isfinite(peaks) & (peaks > 0.0) & (peaks < threshold), peaks, 1.0)
+    if np.all(peaks == 1.0):
+        return table, 0.0
+    shape = [1] * table.ndim
+    shape[batch_axis] = len(peaks)
+    return table / peaks.reshape(shape), np.log(peaks)
+
+
+def _scale_vector(log_scale, axis, ndim):
+    """Returns exp(log_scale), for a vector of batch row exponents, shaped to broadcast along an axis."""
+    shape = [1] * ndim
+    shape[axis] = len(log_scale)
+    return np.exp(log_scale).reshape(shape)
+
+
+def _align_table(factor, positions, labels):
+    """Aligns the table of a factor with the given variable positions and axis labels.
+
+    Events of the factor that are missing from the given labels are dropped, and
+    events that the factor has no value for are filled with zero. The axes of the
+    returned table are ordered by the positions of their variables.
+
+    Parameters
+    ----------
+    factor : Factor
+        the factor to align
+    positions : dict[str, int]
+        a dictionary mapping each variable to its position
+    labels : list[tuple[str]]
+        the axis labels of the variable at each position
+
+    Returns
+    -------
+    (numpy.ndarray, list[int])
+        the aligned table, and the (increasing) positions of its axes
+    """
+
+    table = factor._table
+    axis_positions = [positions[var] for var in factor._variables]
+    targets = [labels[pos] for pos in axis_positions]
+    if not all(old is target or old == target for old, target in zip(factor._labels, targets)):
+        src_index, dest_index = [], []
+        for old, target in zip(factor._labels, targets):
+            pairs = [(i, target.index(val)) for i, val in enumerate(old) if val in target]
+            src_index.append(np.array([i for i, _ in pairs], dtype=int))
+            dest_index.append(np.array([j for _, j in pairs], dtype=int))
+        expanded = np.zeros(tuple(len(target) for target in targets))
+        expanded[np.ix_(*dest_index)] = table[np.ix_(*src_index)]
+        table = expanded
+    order = sorted(range(len(axis_positions)), key=axis_positions.__getitem__)
+    if order != list(range(len(order))):
+        table = np.transpose(table, order)
+    return table, [axis_positions[i] for i in order]
+
+
+def _broadcast(table, positions, shape):
+    """Reshapes an aligned table so that it broadcasts against an array of the given shape."""
+    broadcast_shape = [1] * len(shape)
+    for pos in positions:
+        broadcast_shape[pos] = shape[pos]
+    return table.reshape(broadcast_shape)
+
+
+def _sparse_product(aligned, shape, rescale, output=None, batch=None):
+    """Multiplies aligned tables by joining their nonzero entries.
+
+    Each table is viewed as a relation of (coordinates, value) rows over its nonzero
+    entries. Relations are joined one at a time on the integer-encoded coordinates
+    of their shared axes, so only combinations of nonzero entries are ever formed.
+    If output positions are given, the joined rows are summed directly onto those
+    positions, so the table of the full product is never filled in.
+
+    Returns
+    -------
+    (numpy.ndarray, float or numpy.ndarray)
+        the product table (or its sum onto the output positions), and the log of the
+        scale that was factored out of it (always zero unless rescale is True; one
+        value per batch row if batch, the position of BATCH_VARIABLE, is given)
+    """
+
+    relations = []
+    for table, positions in aligned:
+        nonzero = np.nonzero(table.reshape(table.shape or (1,)))
+        coords = np.stack(nonzero, axis=1)[:, :len(positions)]
+        relations.append((positions, coords, table.reshape(table.shape or (1,))[nonzero]))
+    relations.sort(key=lambda relation: len(relation[2]))
+
+    columns = []
+    coords = np.zeros((1, 0), dtype=int)
+    values = np.ones(1)
+    log_scale = 0.0
+    for positions, f_coords, f_values in relations:
+        shared = [pos for pos in positions if pos in columns]
+        dims = [shape[pos] for pos in shared]
+        left_key = _encode(coords[:, [columns.index(pos) for pos in shared]], dims)
+        right_key = _encode(f_coords[:, [positions.index(pos) for pos in shared]], dims)
+        order = np.argsort(right_key, kind='stable')
+        right_sorted = right_key[order]
+        low = np.searchsorted(right_sorted, left_key, side='left')
+        counts = np.searchsorted(right_sorted, left_key, side='right') - low
+        left_rows = np.repeat(np.arange(len(left_key)), counts)
+        offsets = np.arange(len(left_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        right_rows = order[np.repeat(low, counts) + offsets]
+        new = [i for i, pos in enumerate(positions) if pos not in columns]
+        coords = np.hstack([coords[left_rows], f_coords[right_rows][:, new]])
+        values = values[left_rows] * f_values[right_rows]
+        columns += [positions[i] for i in new]
+        if rescale and batch in columns:
+            values, extra_scale = _rescale_rows(values, coords[:, columns.index(batch)], shape[batch])
+            log_scale = log_scale + extra_scale
+        elif rescale:
+            values, extra_scale = _rescale_if_tiny(values)
+            log_scale += extra_scale
+
+    if output is not None:
+        dims = [shape[pos] for pos in output]
+        keys = _encode(coords[:, [columns.index(pos) for pos in output]], dims)
+        size = int(np.prod(dims))
+        return np.bincount(keys, weights=values, minlength=size).reshape(dims), log_scale
+    table = np.zeros(shape)
+    if len(shape) == 0:
+        table[()] = values.sum()
+    else:
+        table[tuple(coords[:, columns.index(pos)] for pos in range(len(shape)))] = values
+    return table, log_scale
+
+
+def _rescale_rows(values, rows, num_rows):
+    """Divides joined values by the largest value of their batch row, in rows where it is tiny.
+
+    Returns
+    -------
+    (numpy.ndarray, float or numpy.ndarray)
+        the (possibly) rescaled values, and the log of what each batch row was divided by
+    """
+
+    peaks = np.zeros(num_rows)
+    np.maximum.at(peaks, rows, values)
+    peaks = np.where((peaks > 0.0) & (peaks < RESCALE_THRESHOLD), peaks, 1.0)
+    if np.all(peaks == 1.0):
+        return values, 0.0
+    return values / peaks[rows], np.log(peaks)
+
+
+def _encode(coords, dims):
+    """Encodes each row of coordinates as a single integer (in mixed radix)."""
+    if len(dims) == 0:
+        return np.zeros(len(coords), dtype=int)
+    return np.ravel_multi_index(tuple(coords.T), dims)
@@ -1,6 +1,6 @@
 import numpy as np
 import os
-from factor import events, Factor
+from factor import Factor
 from bayes import BayesianNetwork
 
 
@@ -58,6 +58,60 @@ def romanoffs():
     return alexandra, nicholas, alexey, anastasia
 
 
+# The domains of the hemophilia network's variables. An allele is the gene carried on an
+# X chromosome ('X' for the hemophilia gene), and the genotypes are listed by their number
+# of 'X' alleles, so that position i of a genotype domain is the genotype with i such alleles.
+ALLELES = ('x', 'X')
+GENOTYPES = {'male': ('xy', 'Xy'), 'female': ('xx', 'xX', 'XX')}
+HEMOPHILIA = ('-', '+')
+
+# The probability that an allele of a family member with unknown parents is 'X'.
+X_ALLELE_FREQUENCY = 1/30000
+
+
+def _build_cpt_templates():
+    """Computes the tables shared by the CPTs of every family member.
+
+    Returns
+    -------
+    dict[str, object]
+        a dictionary mapping the name of each kind of CPT to its table (or to a dictionary
+        mapping the sex of the family member, or of the parent, to its table)
+    """
+
+    templates = dict()
+    # a male has hemophilia if his only X chromosome carries the gene, a female if both do
+    templates['hemophilia'] = {sex: np.eye(2)[(np.arange(len(genotypes)) == len(genotypes) - 1).astype(int)]
+                               for sex, genotypes in GENOTYPES.items()}
+    # the genotype counts the 'X' alleles inherited from the mother (and the father, for a female)
+    templates['genotype'] = {'male': np.eye(2),
+                             'female': np.eye(3)[np.add.outer(np.arange(2), np.arange(2))]}
+    # the probability of passing on an 'X' allele, indexed by (allele, parent's genotype):
+    # a father passes on his only X chromosome, a mother each of hers with probability 1/2
+    templates['inheritance'] = dict()
+    for sex, genotypes in GENOTYPES.items():
+        passed = np.arange(len(genotypes)) / (len(genotypes) - 1)
+        templates['inheritance'][sex] = np.stack([1.0 - passed, passed])
+    templates['founder'] = np.array([1.0 - X_ALLELE_FREQUENCY, X_ALLELE_FREQUENCY])
+    templates['y_chromosome'] = np.ones(1)
+    # the tables are shared by every CPT built from them, so they must never be modified
+    for table in _template_tables(templates):
+        table.setflags(write=False)
+    return templates
+
+
+def _template_tables(templates):
+    """Yields every table of the given CPT templates."""
+    for template in templates.values():
+        if isinstance(template, dict):
+            yield from template.values()
+        else:
+            yield template
+
+
+CPT_TEMPLATES = _build_cpt_templates()
+
+
 def create_variable_domains(family):
     """Creates a dictionary mapping each variable to its domain, for the hemophilia network.
     For each family member, we create either 3 or 4 variables (3 if they’re male, 4 if they’re female).
@@ -81,19 +135,14 @@ def create_variable_domains(family):
         a dictionary mapping each variable to its domain (i.e. its possible values)
     """
     # question five
-    domains = {}   
-     
-    #hardcode the domains
+    domains = {}
     for member in family:
         name = member.name
-        domains["M_" + name] = ['x','X']
-        domains["H_" + name] = ['-', '+']
-        if member.sex == "male":
-            domains["G_" + name] = ['xy', 'Xy']
-        else:
-            domains["G_" + name] = ['xx', 'xX', 'XX']
-            domains["P_" + name] = ['x', 'X']
-    
+        domains["M_" + name] = list(ALLELES)
+        domains["H_" + name] = list(HEMOPHILIA)
+        domains["G_" + name] = list(GENOTYPES[member.sex])
+        if member.sex == "female":
+            domains["P_" + name] = list(ALLELES)
     return domains
 
 
@@ -109,42 +158,9 @@ def create_hemophilia_cpt(person):
         a Factor specifying the probability of hemophilia, given one's genotype
     """
     # question six
-    G = "G_" + person.name
-    H = "H_" + person.name
-    variables = [G, H]
-    values = {}
-    domains = create_variable_domains([person])
-    event_list = events(variables, domains)
-
-    for event in event_list:
-        if person.sex == 'male':
-            if event[H] == '+':
-                if "X" in event[G]:
-                    #Xy is going to have H
-                    values[tuple(event.values())] = 1.0
-                else: 
-                    #"xy" would not have H
-                    values[tuple(event.values())] = 0.0
-            if event[H] == '-':
-                if "X" in event[G]:
-                    values[tuple(event.values())] = 0.0
-                else:
-                    values[tuple(event.values())] = 1.0
-        if person.sex == 'female':
-            if event[H] == '+':
-                if "XX" in event[G]:
-                    #only XX would have H
-                    values[tuple(event.values())] = 1.0
-                else: 
-                    values[tuple(event.values())] = 0.0
-            if event[H] == '-':
-                if "XX" in event[G]:
-                    values[tuple(event.values())] = 0.0
-                else: 
-                    values[tuple(event.values())] = 1.0
-
-    return Factor(variables, values)
-
+    return Factor.from_table(["G_" + person.name, "H_" + person.name],
+                             [GENOTYPES[person.sex], HEMOPHILIA],
+                             CPT_TEMPLATES['hemophilia'][person.sex])
 
 
 def create_genotype_cpt(person):
@@ -162,34 +178,20 @@ def create_genotype_cpt(person):
     P = "P_" + person.name
     M = "M_" + person.name
     G = "G_" + person.name
-    variables = []
-    values = {}
-    domains = create_variable_domains([person])
-    
-    #separate by sex of the person. If male we do not care about paternal as it is always "y"
+    table = CPT_TEMPLATES['genotype'][person.sex]
+    # a male's paternal gene is always "y", so his genotype only depends on his maternal gene
     if person.sex == 'male':
-        variables = [M, G]
-        event_list = events(variables, domains)
-        
-        for event in event_list:
-            if event[M] in event[G]:
-                values[tuple(event.values())] = 1.0
-            else:
-                values[tuple(event.values())] = 0.0
-    else:
-        variables = [P, M, G]
-        event_list = events(variables, domains)
-        for event in event_list:
-            # compare whether the genotype inherited matches the person's genotype
-            # if so, assign 1.0, else assign 0.0
-            genotype = ''.join(sorted(event[P] + event[M]))
-            sorted_G = ''.join(sorted(event[G]))
-            if sorted_G == genotype:
-                values[tuple(event.values())] = 1.0
-            else:
-                values[tuple(event.values())] = 0.0
-
-    return Factor(variables, values)
+        return Factor.from_table([M, G], [ALLELES, GENOTYPES['male']], table)
+    return Factor.from_table([P, M, G], [ALLELES, ALLELES, GENOTYPES['female']], table)
+
+
+def _create_inheritance_cpt(var, parent):
+    """Creates the CPT of a gene inherited from the given parent (or None if unknown)."""
+    if parent is None:
+        return Factor.from_table([var], [ALLELES], CPT_TEMPLATES['founder'])
+    return Factor.from_table([var, "G_" + parent.name], [ALLELES, GENOTYPES[parent.sex]],
+                             CPT_TEMPLATES['inheritance'][parent.sex])
+
 
 def create_maternal_inheritance_cpt(person):
     """Creates a conditional probability table (CPT) specifying the probability of the gene inherited from one's mother.
@@ -203,33 +205,7 @@ def create_maternal_inheritance_cpt(person):
         a Factor specifying the probability of the gene inherited from the family member's mother.
     """
     # question eight
-    M = "M_" + person.name
-    variables = [M]
-    values = {}
-    mother = person.mother
-    if mother == None:
-        values[tuple('x')] = 29999/30000
-        values[tuple('X')] = 1/30000
-    else:
-        G = "G_" + mother.name
-        variables.append(G)
-        domains = create_variable_domains([person, mother])
-        event_list = events(variables, domains)
-
-        for event in event_list:
-            if event[G] == 'xx':
-                if event[M] == 'x':
-                    values[tuple(event.values())] = 1.0
-                else:
-                    values[tuple(event.values())] = 0.0
-            elif event[G] == 'XX':
-                if event[M] == 'x':
-                    values[tuple(event.values())] = 0.0
-                else:
-                    values[tuple(event.values())] = 1.0
-            else:
-                values[tuple(event.values())] = 0.5
-    return Factor(variables, values)
+    return _create_inheritance_cpt("M_" + person.name, person.mother)
 
 
 def create_paternal_inheritance_cpt(person):
@@ -245,28 +221,10 @@ def create_paternal_inheritance_cpt(person):
     """
     # question nine
     P = "P_" + person.name
-    variables = [P]
-    values = {}
     if person.sex == 'male':
-        values[tuple('y')] = 1
-    else:
-        father = person.father
-        if father is None:
-            values[tuple('x')] = 29999/30000
-            values[tuple('X')] = 1/30000
-        else:
-            G = "G_" + father.name
-            variables.append(G)
-            domains = create_variable_domains([person, father])
-            event_list = events(variables, domains)
-            
-            for event in event_list:
-                if event[P] in event[G]:
-                    values[tuple(event.values())] = 1.0
-                else:
-                    values[tuple(event.values())] = 0.0
-
-    return Factor(variables, values)  
+        return Factor.from_table([P], [('y',)], CPT_TEMPLATES['y_chromosome'])
+    return _create_inheritance_cpt(P, person.father)
+
 
 def create_family_bayes_net(family):
     """Creates a Bayesian network that models the genetic inheritance of hemophilia within a family.
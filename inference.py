@@ -1,21 +1,37 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 from util import compute_elimination_order, build_junction_tree
-from factor import multiply_factors
-from bayes import BayesianNetwork
+import numpy as np
+from factor import Factor, multiply_factors, sum_product
+from bayes import BayesianNetwork, BATCH_VARIABLE, batch_likelihoods, split_batch
 
 # Change this flag to True once you've implemented belief propagation.
 ACTIVATE_BELIEF_PROPAGATION = True
 
 def run_inference(bnet, evidence):
+    """Runs inference on a Bayesian network, or on a CompiledNetwork or DecomposedNetwork.
+
+    Passing a CompiledNetwork avoids rebuilding the junction tree for every query, and
+    only recomputes the messages affected by the observations that changed since the
+    previous call.
+    """
     if ACTIVATE_BELIEF_PROPAGATION:
-        return belief_propagation(bnet, evidence)
+        if not isinstance(bnet, (CompiledNetwork, DecomposedNetwork)):
+            return belief_propagation(bnet, evidence)
+        bnet.update_evidence(evidence)
+        return bnet.get_marginals()
     else:
+        if isinstance(bnet, (CompiledNetwork, DecomposedNetwork)):
+            bnet = bnet.get_network()
         cond_dist = bnet.compute_conditional(["G_elizabeth_ii"], evidence)
         return {'G_elizabeth_ii': cond_dist}
 
 def message_passing(jtree, compute_leaf_msg, compute_msg):
     """Runs a general message-passing algorithm over a junction tree.
 
+    The messages are computed in the order of the tree's message schedule (see
+    JunctionTree.get_message_schedule), which is deterministic.
+
     Parameters
     ----------
     jtree : JunctionTree
@@ -35,36 +51,82 @@ def message_passing(jtree, compute_leaf_msg, compute_msg):
         a dictionary mapping each edge to its message
     """
 
-    def update_ready_list(node):
-        if len(waiting_for[node]) == 1:
-            neighbor = list(waiting_for[node])[0]
-            if (node, neighbor) not in messages:
-                ready_to_process.add((node, neighbor))
-        elif len(waiting_for[node]) == 0:
-            for neighbor in jtree.get_neighbors(node):
-                if (node, neighbor) not in messages:
-                    ready_to_process.add((node, neighbor))
+    # the schedule is cached by the tree, so repeated runs skip the scheduling
+    schedule = jtree.get_message_schedule()
+    results = []
+    for src, dest, incoming in schedule:
+        if len(incoming) == 0:
+            results.append(compute_leaf_msg(src))
+        else:
+            results.append(compute_msg(src, dest, [results[index] for index in incoming]))
+    return {(src, dest): result for (src, dest, _), result in zip(schedule, results)}
+
+def parallel_message_passing(jtree, compute_leaf_msg, compute_msg, executor=None, max_workers=None):
+    """Runs a general message-passing algorithm over a junction tree, computing independent messages concurrently.
+
+    This takes the same callbacks as message_passing and returns the same messages,
+    but every message whose inputs are available is submitted to an executor right
+    away, so messages on disjoint subtrees are computed at the same time.
+
+    Parameters
+    ----------
+    jtree : JunctionTree
+        the junction tree
+    compute_leaf_msg : lambda leaf: ...
+        computes the message that a leaf sends to its only neighbor (see message_passing)
+    compute_msg : lambda src, dest, msgs: ...
+        computes the message that node src sends to node dest (see message_passing)
+    executor : concurrent.futures.Executor
+        the executor to run the callbacks on; a ProcessPoolExecutor only works if the
+        callbacks (and the messages) can be pickled. By default, a ThreadPoolExecutor is
+        used, which pays off when the callbacks release the GIL (e.g. in NumPy)
+    max_workers : int
+        the number of threads of the default executor
+
+    Returns
+    -------
+    dict[(int, int), object]
+        a dictionary mapping each edge to its message
+    """
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
     messages = dict()
-    leaves = [node for node in range(jtree.get_num_nodes()) if jtree.is_leaf(node)]
-    for leaf in leaves:
-        only_neighbor = jtree.get_neighbors(leaf)[0]
-        messages[(leaf, only_neighbor)] = compute_leaf_msg(leaf)
-    waiting_for = [set() for _ in range(jtree.get_num_nodes())]
-    for (node1, node2) in jtree.get_edges():
-        if (node2, node1) not in messages:
-            waiting_for[node1].add(node2)
-        if (node1, node2) not in messages:
-            waiting_for[node2].add(node1)
-    ready_to_process = set()
-    for node in range(len(waiting_for)):
-        update_ready_list(node)
-    while len(ready_to_process) > 0:
-        src, dest = ready_to_process.pop()
-        other_neighbors = set(jtree.get_neighbors(src)) - {dest}
-        msgs = [messages[(neighbor, src)] for neighbor in other_neighbors]
-        messages[(src, dest)] = compute_msg(src, dest, msgs)
-        waiting_for[dest].remove(src)
-        update_ready_list(dest)
+    pending = dict()
+    submitted = set()
+    received = [0 for _ in range(jtree.get_num_nodes())]
+
+    def submit(src, dest):
+        submitted.add((src, dest))
+        msgs = [messages[(neighbor, src)] for neighbor in jtree.get_neighbors(src) if neighbor != dest]
+        pending[executor.submit(compute_msg, src, dest, msgs)] = (src, dest)
+
+    try:
+        for node in range(jtree.get_num_nodes()):
+            if jtree.is_leaf(node):
+                edge = (node, jtree.get_neighbors(node)[0])
+                submitted.add(edge)
+                pending[executor.submit(compute_leaf_msg, node)] = edge
+        while len(pending) > 0:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                src, dest = pending.pop(future)
+                messages[(src, dest)] = future.result()
+                received[dest] += 1
+                neighbors = jtree.get_neighbors(dest)
+                if received[dest] == len(neighbors) - 1:
+                    # dest can now send to the only neighbor it has not heard from
+                    for neighbor in neighbors:
+                        if (neighbor, dest) not in messages and (dest, neighbor) not in submitted:
+                            submit(dest, neighbor)
+                elif received[dest] == len(neighbors):
+                    for neighbor in neighbors:
+                        if (dest, neighbor) not in submitted:
+                            submit(dest, neighbor)
+    finally:
+        if own_executor:
+            executor.shutdown()
     return messages
 
 def count_nodes(jtree):
@@ -91,30 +153,6 @@ def count_nodes(jtree):
         if jtree.is_leaf(dest):
             return 1 + messages[(src, dest)]
         
-# A recursive helper method that returns a list of variables that appear in factors 
-# from all decessors of the src node    
-def get_variables_helper(src, dest, jtree):
-    result = []
-    #if at leaf, return variables in the factor
-    if jtree.is_leaf(src):
-        return jtree.get_factor(src)._variables
-    #else, get the union of the variables of its decessors
-    for current in jtree.get_neighbors(src):            
-        if current != dest:
-            variables = get_variables_helper(current, src, jtree)
-            result = list(set().union(result, variables))
-
-    return result
-    
-#A helper method that returns to the separators    
-def get_separator_helper(src, dest, jtree):
-    #get the union of variables from each side
-    oneside = get_variables_helper(src, dest, jtree)
-    otherside = get_variables_helper(dest, src, jtree)
-    #get the intersection of the two unions
-    to_return = (set(oneside) & set(otherside))
-    return to_return
-
 def compute_separators(jtree):
     """Computes the separator of each edge of a junction tree.
 
@@ -123,6 +161,10 @@ def compute_separators(jtree):
     two separate trees, separator variables are the ones that appear in the
     factors of both trees.
 
+    The separators are computed in a single message-passing sweep, in which each
+    message counts how often the variables on its side of the edge occur. The result
+    is stored on the junction tree, so later calls return it directly.
+
     Parameters
     ----------
     jtree : JunctionTree
@@ -133,41 +175,556 @@ def compute_separators(jtree):
     dict[(int, int), set[int]]
         a dictionary that ssociates each junction tree edge with its separators
     """
-    messages = message_passing(jtree, 
-                                lambda leaf: get_separator_helper(leaf, jtree.get_neighbors(leaf)[0], jtree),
-                                lambda src, dest, msgs: get_separator_helper(src, dest, jtree))
-    return messages
+    if jtree.get_separators() is not None:
+        return jtree.get_separators()
+    # how many nodes mention each variable
+    totals = defaultdict(int)
+    for node in range(jtree.get_num_nodes()):
+        for var in node_variables(jtree, node):
+            totals[var] += 1
+
+    def open_variables(src, msgs):
+        # counts the occurrences of each variable on the src side of the edge, keeping only
+        # the variables that still occur somewhere on the other side (i.e. the separator)
+        counts = defaultdict(int)
+        for var in node_variables(jtree, src):
+            counts[var] += 1
+        for msg in msgs:
+            for var, count in msg.items():
+                counts[var] += count
+        return {var: count for var, count in counts.items() if count < totals[var]}
+
+    messages = message_passing(jtree,
+                               lambda leaf: open_variables(leaf, []),
+                               lambda src, dest, msgs: open_variables(src, msgs))
+    separators = {edge: set(msg) for edge, msg in messages.items()}
+    jtree.set_separators(separators)
+    return separators
+
+def node_variables(jtree, node):
+    """Returns the set of variables that appear in the factors of a junction tree node."""
+    result = set()
+    for factor in jtree.get_factors(node):
+        result.update(factor.get_variables())
+    return result
+
+def project(factors, variables, domains):
+    """Multiplies a list of factors and sums out everything except the specified variables.
+
+    Parameters
+    ----------
+    factors : list[Factor]
+        the factors to multiply
+    variables : set[str]
+        the variables to keep
+    domains : dict[str, list[str]]
+        a dictionary mapping each variable to its possible values
+
+    Returns
+    -------
+    Factor
+        the product of the factors, marginalized onto the specified variables
+    """
+    return sum_product(factors, domains, variables)
+
+
+def _check_thread_executor(executor):
+    """Raises a ValueError if an executor runs its tasks in other processes.
+
+    The messages of a compiled network are computed by closures over its potentials,
+    which cannot be pickled (and shipping the potentials along with every message would
+    cost more than computing it). Queries are spread over processes by
+    parallel.ParallelQueryRunner instead, which ships the network to each worker once.
+    """
+    if isinstance(executor, ProcessPoolExecutor):
+        raise ValueError('Messages can only be computed concurrently on threads; '
+                         'use parallel.ParallelQueryRunner to run queries on worker processes')
+
+
+class CompiledNetwork:
+    """A Bayesian network compiled into a junction tree.
+
+    The junction tree, its separators, the node potentials and the order in which
+    messages are sent (the schedule cached by the junction tree) are computed once,
+    when the network is compiled. Each query then only has to enter its evidence and
+    pass messages (Shafer-Shenoy style: one collect pass and one distribute pass).
+    """
+
+    def __init__(self, bnet, method='mst'):
+        """
+        Parameters
+        ----------
+        bnet : BayesianNetwork
+            the Bayesian network to compile
+        method : str
+            how the junction tree is built (see util.build_junction_tree)
+        """
+
+        self._bnet = bnet
+        self._domains = bnet.get_domains()
+        self._jtree = build_junction_tree(bnet, method)
+        compute_separators(self._jtree)
+        self._potentials = []
+        for node in range(self._jtree.get_num_nodes()):
+            factors = self._jtree.get_factors(node)
+            self._potentials.append(multiply_factors(factors, self._domains) if len(factors) > 0 else None)
+        # the message schedule is cached by the junction tree, so it is computed only once
+        self._jtree.get_message_schedule()
+        # each variable is read off the first node whose potential mentions it
+        self._homes = dict()
+        for node, potential in enumerate(self._potentials):
+            if potential is not None:
+                for var in potential.get_variables():
+                    self._homes.setdefault(var, node)
+        # state of the incremental interface (see set_evidence)
+        self._evidence = dict()
+        self._entered = list(self._potentials)
+        self._messages = dict()
+
+    def get_network(self):
+        """Returns the compiled Bayesian network."""
+        return self._bnet
+
+    def get_junction_tree(self):
+        """Returns the junction tree of the compiled network."""
+        return self._jtree
+
+    def likelihood(self, var, value):
+        """Returns the likelihood factor that enters the observation var=value as evidence.
+
+        Parameters
+        ----------
+        var : str
+            the observed variable
+        value : str
+            the observed value
+
+        Returns
+        -------
+        Factor
+            a factor over var that is 1 for the observed value and 0 otherwise
+        """
+        labels = tuple(self._domains[var])
+        table = np.array([1.0 if val == value else 0.0 for val in labels])
+        return Factor.from_table([var], [labels], table)
+
+    def calibrate(self, evidence, executor=None):
+        """Calibrates the junction tree with a collect pass followed by a distribute pass.
+
+        Each observation is entered as a likelihood factor at the home node of its
+        variable, then every message is computed exactly once.
+
+        Parameters
+        ----------
+        evidence : dict[str, str]
+            the evidence event (represented as a dictionary mapping variables to values)
+        executor : concurrent.futures.Executor
+            if provided, independent messages are computed concurrently on this executor
+            (see parallel_message_passing) instead of following the two-pass schedule.
+            It must run its tasks on threads (see _check_thread_executor)
+
+        Returns
+        -------
+        (list[Factor], dict[(int, int), Factor])
+            the node potentials (with the evidence entered) and the message sent along
+            each directed edge
+        Raises
+        ------
+        ValueError
+            If the executor is a ProcessPoolExecutor.
+        """
+
+        likelihoods = [self.likelihood(var, value) for var, value in evidence.items()]
+        return self._calibrate(likelihoods, self._domains, executor)
+
+    def _calibrate(self, likelihoods, domains, executor=None):
+        """Enters likelihood factors at the home nodes of their variables, then passes all messages.
+
+        A likelihood factor may also mention BATCH_VARIABLE, which is then kept in every
+        message that depends on it.
+        """
+        if executor is not None:
+            _check_thread_executor(executor)
+        potentials = list(self._potentials)
+        for likelihood in likelihoods:
+            var = [var for var in likelihood.get_variables() if var != BATCH_VARIABLE][0]
+            node = self._homes[var]
+            potentials[node] = multiply_factors([potentials[node], likelihood], domains)
+
+        def compute_msg(src, dest, msgs):
+            factors = list(msgs)
+            if potentials[src] is not None:
+                factors.append(potentials[src])
+            separator = self._jtree.get_separator(src, dest) | {BATCH_VARIABLE}
+            return project(factors, separator, domains)
+
+        compute_leaf_msg = lambda leaf: compute_msg(leaf, self._jtree.get_neighbors(leaf)[0], [])
+        if executor is not None:
+            messages = parallel_message_passing(self._jtree, compute_leaf_msg, compute_msg, executor)
+        else:
+            messages = message_passing(self._jtree, compute_leaf_msg, compute_msg)
+        return potentials, messages
+
+    def query(self, evidence, executor=None):
+        """Computes all single variable distributions, conditioned on the evidence.
+
+        All distributions are read off the beliefs of a single calibration.
+
+        Parameters
+        ----------
+        evidence : dict[str, str]
+            the evidence event (represented as a dictionary mapping variables to values)
+        executor : concurrent.futures.Executor
+            if provided, the calibration computes independent messages concurrently
+            (on threads, see calibrate)
+
+        Returns
+        -------
+        dict[str, Factor]
+            a dictionary that maps each variable v to P(v | evidence)
+        """
+
+        potentials, messages = self.calibrate(evidence, executor)
+        return self._read_marginals(lambda node: self._belief(node, potentials[node], lambda edge: messages[edge]))
+
+    def query_batch(self, evidence_list):
+        """Computes all single variable distributions, for each of several evidence events.
+
+        The whole batch is handled by a single calibration: the evidence events are
+        entered as likelihood factors over BATCH_VARIABLE, and messages that do not
+        depend on any evidence are computed once for the whole batch.
+
+        Parameters
+        ----------
+        evidence_list : list[dict[str, str]]
+            the evidence events
+
+        Returns
+        -------
+        list[dict[str, Factor]]
+            for each evidence event, a dictionary that maps each variable v to P(v | evidence)
+        """
+
+        if len(evidence_list) == 0:
+            return []
+        domains = dict(self._domains)
+        domains[BATCH_VARIABLE] = range(len(evidence_list))
+        potentials, messages = self._calibrate(batch_likelihoods(evidence_list, self._domains), domains)
+        homes = defaultdict(list)
+        for var, node in self._homes.items():
+            homes[node].append(var)
+        results = [dict() for _ in evidence_list]
+        for node, variables in homes.items():
+            factors = [potentials[node]] + [messages[(neighbor, node)] for neighbor in self._jtree.get_neighbors(node)]
+            belief = multiply_factors(factors, domains)
+            for var in variables:
+                marginals = split_batch(project([belief], {var, BATCH_VARIABLE}, domains), len(evidence_list))
+                for result, marginal in zip(results, marginals):
+                    result[var] = marginal
+        return results
+
+    def _read_marginals(self, get_belief):
+        """Reads the distribution of every variable off the belief of its home node.
+
+        The variables are grouped by home node, so each belief is computed only once.
+        """
+        homes = defaultdict(list)
+        for var, node in self._homes.items():
+            homes[node].append(var)
+        marginals = dict()
+        for node, variables in homes.items():
+            belief = get_belief(node)
+            for var in variables:
+                marginals[var] = project([belief], {var}, self._domains).normalize()
+        return marginals
+
+    def _belief(self, node, potential, get_message):
+        """Multiplies the potential of a node with all of the messages it receives."""
+        factors = [potential] + [get_message((neighbor, node)) for neighbor in self._jtree.get_neighbors(node)]
+        return multiply_factors(factors, self._domains)
+
+    def get_evidence(self):
+        """Returns the evidence currently entered through set_evidence."""
+        return dict(self._evidence)
+
+    def set_evidence(self, var, value):
+        """Observes a variable, keeping every cached message that the observation does not affect.
+
+        Only the messages that point away from the node where the observation is
+        entered become invalid. They are recomputed lazily, when a marginal that
+        depends on them is requested through get_marginal.
+
+        Parameters
+        ----------
+        var : str
+            the observed variable
+        value : str
+            the observed value
+        """
+        if self._evidence.get(var) != value:
+            self._evidence[var] = value
+            self._update_home(self._homes[var])
+
+    def retract_evidence(self, var):
+        """Removes the observation of a variable (see set_evidence).
+
+        Parameters
+        ----------
+        var : str
+            the variable that is no longer observed
+        """
+        if var in self._evidence:
+            del self._evidence[var]
+            self._update_home(self._homes[var])
+
+    def update_evidence(self, evidence):
+        """Replaces the current evidence, changing only the observations that differ.
+
+        Parameters
+        ----------
+        evidence : dict[str, str]
+            the new evidence event
+        """
+        for var in list(self._evidence):
+            if var not in evidence:
+                self.retract_evidence(var)
+        for var, value in evidence.items():
+            self.set_evidence(var, value)
+
+    def get_marginal(self, var):
+        """Computes P(var | evidence) for the evidence entered through set_evidence.
+
+        Parameters
+        ----------
+        var : str
+            the variable of interest
+
+        Returns
+        -------
+        Factor
+            the conditional distribution of the variable
+        """
+        node = self._homes[var]
+        belief = self._belief(node, self._entered[node], self._message)
+        return project([belief], {var}, self._domains).normalize()
+
+    def get_marginals(self):
+        """Computes P(v | evidence) for every variable v, for the evidence entered through set_evidence.
+
+        Returns
+        -------
+        dict[str, Factor]
+            a dictionary that maps each variable v to P(v | evidence)
+        """
+        return self._read_marginals(lambda node: self._belief(node, self._entered[node], self._message))
+
+    def _update_home(self, node):
+        """Re-enters the evidence at a node and invalidates the messages that point away from it."""
+        factors = [self._potentials[node]]
+        for var, value in self._evidence.items():
+            if self._homes[var] == node:
+                factors.append(self.likelihood(var, value))
+        self._entered[node] = multiply_factors(factors, self._domains)
+        # a missing message implies that every message depending on it is missing too
+        frontier = [(node, neighbor) for neighbor in self._jtree.get_neighbors(node)]
+        while len(frontier) > 0:
+            src, dest = frontier.pop()
+            if (src, dest) in self._messages:
+                del self._messages[(src, dest)]
+                frontier += [(dest, neighbor) for neighbor in self._jtree.get_neighbors(dest) if neighbor != src]
+
+    def _message(self, edge):
+        """Returns the message along an edge, computing any missing messages it depends on."""
+        # find the missing messages that this one depends on (without descending past cached ones)
+        missing = []
+        frontier = [edge]
+        while len(frontier) > 0:
+            src, dest = frontier.pop()
+            if (src, dest) not in self._messages:
+                missing.append((src, dest))
+                frontier += [(neighbor, src) for neighbor in self._jtree.get_neighbors(src) if neighbor != dest]
+        for (src, dest) in reversed(missing):
+            factors = [self._messages[(neighbor, src)] for neighbor in self._jtree.get_neighbors(src) if neighbor != dest]
+            if self._entered[src] is not None:
+                factors.append(self._entered[src])
+            self._messages[(src, dest)] = project(factors, self._jtree.get_separator(src, dest), self._domains)
+        return self._messages[edge]
+
+
+class DecomposedNetwork:
+    """A Bayesian network compiled one connected component at a time.
+
+    A pedigree of many unrelated families is split into its components (see
+    BayesianNetwork.get_components), and each component is compiled into its own
+    junction tree the first time it is queried. A query about one family therefore
+    only pays for that family, and queries about several families can calibrate
+    their components in parallel.
+    """
+
+    def __init__(self, bnet):
+        """
+        Parameters
+        ----------
+        bnet : BayesianNetwork
+            the Bayesian network to compile
+        """
+
+        self._bnet = bnet
+        self._components = bnet.get_components()
+        self._component_of = dict()
+        for i, component in enumerate(self._components):
+            for var in component.get_variables():
+                self._component_of[var] = i
+        self._compiled = [None for _ in self._components]
+
+    def get_network(self):
+        """Returns the compiled Bayesian network."""
+        return self._bnet
+
+    def get_components(self):
+        """Returns the connected components of the network (see BayesianNetwork.get_components)."""
+        return self._components
+
+    def get_compiled(self, var):
+        """Returns the CompiledNetwork of the component that contains a variable, compiling it if needed."""
+        return self._compiled_component(self._component_of[var])
+
+    def _compiled_component(self, i):
+        if self._compiled[i] is None:
+            self._compiled[i] = CompiledNetwork(self._components[i])
+        return self._compiled[i]
+
+    def query(self, evidence, vars=None, executor=None):
+        """Computes single variable distributions, conditioned on the evidence.
+
+        Parameters
+        ----------
+        evidence : dict[str, str]
+            the evidence event (represented as a dictionary mapping variables to values)
+        vars : collection[str]
+            if provided, only the components that contain these variables are compiled
+            and calibrated (otherwise, every component is)
+        executor : concurrent.futures.Executor
+            if provided, the components are compiled and calibrated concurrently on it
+            (it must run its tasks on threads, see _check_thread_executor)
+
+        Returns
+        -------
+        dict[str, Factor]
+            a dictionary that maps each variable v of the queried components to P(v | evidence)
+        Raises
+        ------
+        ValueError
+            If the executor is a ProcessPoolExecutor.
+        """
+
+        if vars is None:
+            selected = range(len(self._components))
+        else:
+            selected = sorted({self._component_of[var] for var in vars})
+        local_evidence = {i: dict() for i in selected}
+        for var, value in evidence.items():
+            i = self._component_of.get(var)
+            if i in local_evidence:
+                local_evidence[i][var] = value
+        if executor is not None:
+            _check_thread_executor(executor)
+        query_component = lambda i: self._compiled_component(i).query(local_evidence[i])
+        if executor is None:
+            results = [query_component(i) for i in selected]
+        else:
+            results = executor.map(query_component, selected)
+        marginals = dict()
+        for result in results:
+            marginals.update(result)
+        return marginals
+
+    def get_evidence(self):
+        """Returns the evidence currently entered through set_evidence."""
+        evidence = dict()
+        for compiled in self._compiled:
+            if compiled is not None:
+                evidence.update(compiled.get_evidence())
+        return evidence
+
+    def set_evidence(self, var, value):
+        """Observes a variable (see CompiledNetwork.set_evidence)."""
+        self.get_compiled(var).set_evidence(var, value)
+
+    def retract_evidence(self, var):
+        """Removes the observation of a variable (see CompiledNetwork.retract_evidence)."""
+        i = self._component_of[var]
+        if self._compiled[i] is not None:
+            self._compiled[i].retract_evidence(var)
+
+    def update_evidence(self, evidence):
+        """Replaces the current evidence, changing only the observations that differ."""
+        for var in self.get_evidence():
+            if var not in evidence:
+                self.retract_evidence(var)
+        for var, value in evidence.items():
+            self.set_evidence(var, value)
+
+    def get_marginal(self, var):
+        """Computes P(var | evidence) for the evidence entered through set_evidence."""
+        return self.get_compiled(var).get_marginal(var)
+
+    def get_marginals(self):
+        """Computes P(v | evidence) for every variable v, for the evidence entered through set_evidence."""
+        marginals = dict()
+        for i in range(len(self._components)):
+            marginals.update(self._compiled_component(i).get_marginals())
+        return marginals
+
+
+def collect_distribute_schedule(jtree):
+    """Returns the two-pass message schedule of a junction tree (or forest).
+
+    The first node of each tree is taken as its root. During the collect pass, messages
+    flow from the leaves towards the root; during the distribute pass, they flow back
+    from the root towards the leaves. This is the schedule that message_passing replays
+    (see JunctionTree.get_message_schedule), with the incoming messages given as edges.
+
+    Parameters
+    ----------
+    jtree : JunctionTree
+        the junction tree
+
+    Returns
+    -------
+    list[(int, int, list[(int, int)])]
+        a list of (src, dest, incoming) triples, where incoming lists the edges whose
+        messages are needed to compute the message from src to dest
+    """
+
+    schedule = jtree.get_message_schedule()
+    return [(src, dest, [schedule[index][:2] for index in incoming]) for (src, dest, incoming) in schedule]
+
+
+def belief_propagation_batch(bnet, evidence_list):
+    """Computes all single variable distributions, for each of several evidence events.
+
+    Parameters
+    ----------
+    bnet : BayesianNetwork
+        the Bayesian network
+    evidence_list : list[dict[str, str]]
+        the evidence events
+
+    Returns
+    -------
+    list[dict[str, Factor]]
+        for each evidence event, a dictionary that maps each variable v to P(v | evidence)
+    """
+    return CompiledNetwork(bnet).query_batch(evidence_list)
+
 
-def marginalize_helper_for_leaf(leaf, jtree):
-    factor = jtree.get_factor(leaf)
-    neighbors = jtree.get_neighbors(leaf)
-    edge = (leaf, neighbors[0])
-    separators = jtree._separators[edge]
-    variables = factor._variables
-
-    for var in variables:
-        if var not in separators:
-            factor = factor.marginalize(var)
-    
-    return factor
-
-def marginalize_helper_for_non_leaf(src, dest, jtree, msgs, domains):
-    separators = jtree._separators[(src, dest)]
-    factor = multiply_factors(msgs, domains)
-    variables = factor._variables
-
-    for var in variables:
-        if var not in separators:
-            factor = factor.marginalize(var)
-    
-    return factor
-    
-def belief_propagation(bnet, evidence):
+def belief_propagation(bnet, evidence, query=None):
     """Computes all single variable distributions, conditioned on the evidence.
 
     This should return a dictionary that maps each variable v to P(v | evidence).
     These distributions should be computed using the junction tree algorithm
-    discussed in class.
+    discussed in class. All of them are read off a single calibration of the tree.
 
     Parameters
     ----------
@@ -175,38 +732,25 @@ def belief_propagation(bnet, evidence):
         the Bayesian network
     evidence : dict[str, str]
         the evidence event (represented as a dictionary mapping variables to values)
+    query : collection[str]
+        if provided, only the distributions of these variables are computed, and the
+        network is pruned of the factors that are irrelevant to them beforehand
 
     Returns
     -------
     dict[str, Factor]
         a dictionary that maps each variable v to P(v | evidence)
     """
-    jtree = build_junction_tree(bnet)
-    jtree._separators = compute_separators(jtree)
-    messages = message_passing(jtree, 
-                                lambda leaf: marginalize_helper_for_leaf(leaf, jtree), 
-                                lambda src, dest, msgs: marginalize_helper_for_non_leaf(src, dest, jtree, msgs, bnet._domains))
-    to_return = {}
-    variables = bnet._variables
-    for var in variables:
-        for (src, dest) in messages:
-            if jtree.is_leaf(dest):
-                factor = jtree.get_factor(dest)
-
-                #choose a leaf containing the variable
-                if var in factor._variables:
-                    received_mess = messages[(src, dest)]
-                    
-                    #multiply its factor with its recieved message
-                    new_factor = multiply_factors([factor, received_mess], bnet._domains)
-                    new_variables = new_factor._variables
-
-                    #marginalize out other variables
-                    for v in new_variables:
-                        if v != var:
-                            new_factor = new_factor.marginalize(v)
-
-                    to_return[var] = bnet.compute_conditional([var], evidence)
-                    
-                    
-    return to_return
\ No newline at end of file
+    if query is not None:
+        # observed variables are conditioned out of the pruned network, so they are
+        # answered with a point mass on the observed value, as calibration would give
+        unobserved = [var for var in query if var not in evidence]
+        marginals = CompiledNetwork(bnet.prune(unobserved, evidence)).query({}) if unobserved else {}
+        domains = bnet.get_domains()
+        for var in query:
+            if var in evidence:
+                labels = tuple(domains[var])
+                table = np.array([1.0 if val == evidence[var] else 0.0 for val in labels])
+                marginals[var] = Factor.from_table([var], [labels], table)
+        return {var: marginals[var] for var in query}
+    return DecomposedNetwork(bnet).query(evidence)
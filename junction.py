@@ -47,12 +47,26 @@ class JunctionTree:
 
         Returns
         -------
-        list[int]
-            a list of neighbors, i.e. nodes that have an edge connecting them to the node of interest
+        tuple[int]
+            the neighbors, i.e. nodes that have an edge connecting them to the node of interest
         """
 
         return self._graph.get_neighbors(node)
 
+    def get_message_schedule(self):
+        """Returns the order in which messages can be sent over the junction tree.
+
+        The schedule is computed once and cached (see UndirectedGraph.get_message_schedule).
+
+        Returns
+        -------
+        list[(int, int, tuple[int])]
+            a list of (src, dest, incoming) triples, where incoming holds the positions in
+            the list of the messages that src receives from its neighbors other than dest
+        """
+
+        return self._graph.get_message_schedule()
+
     def get_factor(self, node):
         """Returns the factor associated with a particular node of the junction tree.
 
@@ -74,6 +88,65 @@ class JunctionTree:
         else:
             return None
 
+    def get_factors(self, node):
+        """Returns all factors associated with a particular node of the junction tree.
+
+        Parameters
+        ----------
+        node : int
+            the node of interest
+
+        Returns
+        -------
+        list[Factor]
+             the factors associated with the specified node (possibly none)
+        """
+
+        if node < len(self._factors):
+            return self._factors[node]
+        else:
+            return []
+
+    def get_separators(self):
+        """Returns the separators of the junction tree, if they have been computed.
+
+        Returns
+        -------
+        dict[(int, int), set[str]]
+            a dictionary that associates each directed edge with its separator, or None
+        """
+
+        return self._separators
+
+    def get_separator(self, src, dest):
+        """Returns the separator of a particular edge of the junction tree.
+
+        Parameters
+        ----------
+        src : int
+            the node at one end of the edge
+        dest : int
+            the node at the other end of the edge
+
+        Returns
+        -------
+        set[str]
+            the variables that appear in factors on both sides of the edge
+        """
+
+        return self._separators[(src, dest)]
+
+    def set_separators(self, separators):
+        """Stores the separators of the junction tree.
+
+        Parameters
+        ----------
+        separators : dict[(int, int), set[str]]
+            a dictionary that associates each directed edge with its separator
+        """
+
+        self._separators = separators
+
     def is_leaf(self, node):
         """Returns whether a node is a leaf node.
 
@@ -96,7 +169,7 @@ class JunctionTree:
             if self.is_leaf(node):
                 result += f'\nnode {node} {self._factors[node]}'
             else:
-                result += f'\nnode {node} (neighbors: {self.get_neighbors(node)})'
+                result += f'\nnode {node} (neighbors: {list(self.get_neighbors(node))})'
         return result
 
 
@@ -0,0 +1,96 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from inference import CompiledNetwork
+
+# The network shipped to this worker process (see ParallelQueryRunner).
+_worker_bnet = None
+_worker_compiled = None
+
+
+def _init_worker(payload):
+    global _worker_bnet, _worker_compiled
+    _worker_bnet = pickle.loads(payload)
+    _worker_compiled = None
+
+
+def _worker_conditional(query):
+    vars, evidence = query
+    return _worker_bnet.compute_conditional(vars, evidence)
+
+
+def _worker_belief_propagation(evidence):
+    global _worker_compiled
+    if _worker_compiled is None:
+        # compiled once per worker, then reused for every query it receives
+        _worker_compiled = CompiledNetwork(_worker_bnet)
+    return _worker_compiled.query(evidence)
+
+
+class ParallelQueryRunner:
+    """Runs independent queries against a Bayesian network on a pool of worker processes.
+
+    The network is pickled once and unpickled once by each worker, when the worker
+    starts. Each query then only ships its own variables and evidence, and results
+    are streamed back in the order of the queries.
+    """
+
+    def __init__(self, bnet, max_workers=None):
+        """
+        Parameters
+        ----------
+        bnet : BayesianNetwork
+            the Bayesian network to query
+        max_workers : int
+            the number of worker processes (by default, the number of CPUs)
+        """
+
+        payload = pickle.dumps(bnet, protocol=pickle.HIGHEST_PROTOCOL)
+        self._executor = ProcessPoolExecutor(max_workers=max_workers,
+                                             initializer=_init_worker,
+                                             initargs=(payload,))
+
+    def compute_conditional(self, queries, chunksize=1):
+        """Computes a conditional distribution for each query, using variable elimination.
+
+        Parameters
+        ----------
+        queries : iterable[(list[str], dict[str, str])]
+            (vars, evidence) pairs, as passed to BayesianNetwork.compute_conditional
+        chunksize : int
+            the number of queries sent to a worker at a time
+
+        Returns
+        -------
+        iterator[Factor]
+            the conditional distributions, in the order of the queries
+        """
+
+        return self._executor.map(_worker_conditional, queries, chunksize=chunksize)
+
+    def belief_propagation(self, evidence_list, chunksize=1):
+        """Computes all single variable distributions for each evidence event, using belief propagation.
+
+        Parameters
+        ----------
+        evidence_list : iterable[dict[str, str]]
+            the evidence events
+        chunksize : int
+            the number of evidence events sent to a worker at a time
+
+        Returns
+        -------
+        iterator[dict[str, Factor]]
+            for each evidence event, a dictionary that maps each variable v to P(v | evidence)
+        """
+
+        return self._executor.map(_worker_belief_propagation, evidence_list, chunksize=chunksize)
+
+    def close(self):
+        """Shuts down the worker processes."""
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,233 @@
+import csv
+import os
+from genetics import Male, Female, create_variable_domains
+from genetics import create_hemophilia_cpt, create_genotype_cpt
+from genetics import create_maternal_inheritance_cpt, create_paternal_inheritance_cpt
+from bayes import BayesianNetwork
+
+
+# Codes for an unknown parent, sex or phenotype (LINKAGE / PLINK conventions).
+MISSING_PARENT = {'', '0'}
+MALE_CODES = {'1', 'm', 'male'}
+FEMALE_CODES = {'2', 'f', 'female'}
+# Affection status: 1 is unaffected, 2 is affected, and 0 or -9 is missing.
+PHENOTYPES = {'1': '-', '2': '+', '0': None, '-9': None, '': None}
+
+
+class PedigreeRecord:
+    """A single row of a pedigree file."""
+
+    def __init__(self, family, id, father, mother, sex, phenotype):
+        """
+        Parameters
+        ----------
+        family : str
+            The family id (or None if the file has no family column)
+        id : str
+            The id of the individual (unique within its family)
+        father : str
+            The id of the father (or None if unknown)
+        mother : str
+            The id of the mother (or None if unknown)
+        sex : str
+            The sex of the individual ("male" or "female")
+        phenotype : str
+            Whether the individual has hemophilia ('-' or '+', or None if unknown)
+        """
+
+        self.family = family
+        self.id = id
+        self.father = father
+        self.mother = mother
+        self.sex = sex
+        self.phenotype = phenotype
+
+
+def qualified_name(family, id):
+    """Returns the name of an individual, qualified by its family (if any).
+
+    Ids only need to be unique within a family, so the family id becomes part of the
+    name (and thus of the names of the individual's variables, e.g. G_<family>.<id>).
+    """
+    return id if family is None else f"{family}.{id}"
+
+
+def read_pedigree(path, format=None):
+    """Reads the rows of a pedigree file, one at a time.
+
+    The following formats are supported:
+        - 'ped' (LINKAGE) and 'fam' (PLINK): whitespace-separated columns, namely the
+          family id, individual id, father id, mother id, sex (1 = male, 2 = female)
+          and phenotype (1 = unaffected, 2 = affected, 0 or -9 = missing). The marker
+          genotypes that follow these columns in a .ped file are ignored.
+        - 'csv': a header naming the columns id, mother, father, sex and phenotype
+          (and optionally family), with the same codes (sex may also be male/female).
+    Parameters
+    ----------
+    path : str
+        the path of the pedigree file
+    format : str
+        'ped', 'fam' or 'csv' (by default, the extension of the path)
+    Returns
+    -------
+    iterator[PedigreeRecord]
+        the rows of the file, in order
+    Raises
+    ------
+    ValueError
+        If the format is unknown, or a row is malformed.
+    """
+
+    if format is None:
+        format = os.path.splitext(path)[1].lstrip('.').lower()
+    if format not in ('ped', 'fam', 'csv'):
+        raise ValueError(f'Unknown pedigree format: {format}')
+    with open(path, newline='') as f:
+        if format == 'csv':
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                yield _parse_record(line, row.get('family'), row.get('id'), row.get('father'),
+                                    row.get('mother'), row.get('sex'), row.get('phenotype'))
+        else:
+            for line, text in enumerate(f, start=1):
+                # only split off the six pedigree columns, not the genotypes after them
+                columns = text.split(None, 6)
+                if len(columns) == 0 or columns[0].startswith('#'):
+                    continue
+                if len(columns) < 6:
+                    raise ValueError(f'Line {line}: expected 6 pedigree columns, found {len(columns)}')
+                yield _parse_record(line, *columns[:6])
+
+
+def _parse_record(line, family, id, father, mother, sex, phenotype):
+    """Decodes the fields of a pedigree row into a PedigreeRecord."""
+    if id is None or id.strip() in MISSING_PARENT:
+        raise ValueError(f'Line {line}: missing individual id')
+    sex = (sex or '').strip().lower()
+    if sex in MALE_CODES:
+        sex = 'male'
+    elif sex in FEMALE_CODES:
+        sex = 'female'
+    else:
+        raise ValueError(f'Line {line}: unknown sex for individual {id}')
+    phenotype = (phenotype or '').strip()
+    if phenotype not in PHENOTYPES:
+        raise ValueError(f'Line {line}: unknown phenotype {phenotype} for individual {id}')
+    family = family.strip() if family is not None and family.strip() != '' else None
+    father = father.strip() if father is not None and father.strip() not in MISSING_PARENT else None
+    mother = mother.strip() if mother is not None and mother.strip() not in MISSING_PARENT else None
+    return PedigreeRecord(family, id.strip(), father, mother, sex, PHENOTYPES[phenotype])
+
+
+class PedigreeBuilder:
+    """Builds the hemophilia Bayesian network of a pedigree, one individual at a time.
+
+    The CPTs of an individual are created as soon as the individual is added, except for
+    the inheritance CPTs, which wait until the parent has been added (parents may appear
+    after their children). When the network is built, parents that never appeared are
+    treated as unknown.
+    """
+
+    def __init__(self):
+        self._members = dict()
+        self._domains = dict()
+        self._cpts = []
+        self._evidence = dict()
+        # for each parent that has not been added yet, the children waiting for it
+        self._waiting = dict()
+
+    def add(self, record):
+        """Adds an individual (a row of a pedigree file) to the network.
+        Parameters
+        ----------
+        record : PedigreeRecord
+            the individual
+        Raises
+        ------
+        ValueError
+            If the individual was already added, or is the parent of someone with the
+            wrong sex.
+        """
+
+        name = qualified_name(record.family, record.id)
+        if name in self._members:
+            raise ValueError(f'Individual {name} appears more than once')
+        member = Male(name) if record.sex == 'male' else Female(name)
+        self._members[name] = member
+        self._domains.update(create_variable_domains([member]))
+        self._cpts.append(create_genotype_cpt(member))
+        self._cpts.append(create_hemophilia_cpt(member))
+        if record.phenotype is not None:
+            self._evidence["H_" + name] = record.phenotype
+        for relation, parent_id in (('mother', record.mother), ('father', record.father)):
+            if parent_id is None:
+                self._add_inheritance_cpt(member, relation)
+                continue
+            parent_name = qualified_name(record.family, parent_id)
+            if parent_name in self._members:
+                self._set_parent(member, relation, self._members[parent_name])
+            else:
+                self._waiting.setdefault(parent_name, []).append((member, relation))
+        for child, relation in self._waiting.pop(name, []):
+            self._set_parent(child, relation, member)
+
+    def _set_parent(self, child, relation, parent):
+        """Links a child to one of its parents, and creates the corresponding inheritance CPT."""
+        expected = 'female' if relation == 'mother' else 'male'
+        if parent.get_sex() != expected:
+            raise ValueError(f'The {relation} of {child.get_name()} ({parent.get_name()}) is not {expected}')
+        setattr(child, relation, parent)
+        self._add_inheritance_cpt(child, relation)
+
+    def _add_inheritance_cpt(self, member, relation):
+        if relation == 'mother':
+            self._cpts.append(create_maternal_inheritance_cpt(member))
+        elif member.get_sex() == 'female':
+            # a male's paternal gene is always "y", so it needs no CPT
+            self._cpts.append(create_paternal_inheritance_cpt(member))
+
+    def get_members(self):
+        """Returns a dictionary mapping the (qualified) name of each individual to its FamilyMember."""
+        return self._members
+
+    def get_evidence(self):
+        """Returns the observed phenotypes, as an evidence event over the H_ variables."""
+        return self._evidence
+
+    def build(self):
+        """Creates the Bayesian network of the individuals added so far.
+        Parents that have not been added by then are treated as unknown.
+        Returns
+        -------
+        BayesianNetwork
+            a Bayesian network that models the genetic inheritance of hemophilia within the pedigree
+        """
+
+        for children in self._waiting.values():
+            for child, relation in children:
+                self._add_inheritance_cpt(child, relation)
+        self._waiting = dict()
+        bnet = BayesianNetwork(self._cpts, self._domains)
+        # min-degree (without fill edges) produces very wide orders on large pedigrees
+        bnet.set_elimination_heuristic('min_fill')
+        return bnet
+
+
+def load_pedigree(path, format=None):
+    """Reads a pedigree file into a hemophilia Bayesian network.
+    Parameters
+    ----------
+    path : str
+        the path of the pedigree file
+    format : str
+        'ped', 'fam' or 'csv' (by default, the extension of the path; see read_pedigree)
+    Returns
+    -------
+    (BayesianNetwork, dict[str, str], dict[str, FamilyMember])
+        the Bayesian network, the observed phenotypes (as an evidence event) and the
+        family members (by qualified name)
+    """
+
+    builder = PedigreeBuilder()
+    for record in read_pedigree(path, format):
+        builder.add(record)
+    return builder.build(), builder.get_evidence(), builder.get_members()
@@ -1,7 +1,12 @@
 import unittest
 import pandas as pd
+import factor
+from factor import Factor
+from bayes import BayesianNetwork
 from montyhall import create_montyhall_bayes_net
 from vampire import create_vampire_bayes_net
+from covid import create_covid_bayes_net
+from util import compute_elimination_order
 
 
 def compute_probability(bnet, event):
@@ -67,5 +72,244 @@ class TestFour(unittest.TestCase):
                                                {'Z': 'AB', 'X': 'A'})
         self.assertAlmostEqual(prob, 1/3)
 
+class TestCache(unittest.TestCase):
+
+    def test_cache_hits(self):
+        bnet = create_vampire_bayes_net()
+        bnet.enable_cache(maxsize=2)
+        first = bnet.compute_conditional(['Y'], {'Z': 'A'})
+        second = bnet.compute_conditional(['Y'], {'Z': 'A'})
+        self.assertIs(first, second)
+        self.assertEqual(bnet.cache_info(), {'hits': 1, 'misses': 1, 'maxsize': 2, 'currsize': 1})
+
+    def test_cache_eviction(self):
+        bnet = create_vampire_bayes_net()
+        bnet.enable_cache(maxsize=2)
+        bnet.compute_marginal(['X'])
+        bnet.compute_marginal(['Y'])
+        bnet.compute_marginal(['X'])
+        bnet.compute_marginal(['Z'])
+        bnet.compute_marginal(['X'])
+        bnet.compute_marginal(['Y'])
+        self.assertEqual(bnet.cache_info()['hits'], 2)
+        self.assertEqual(bnet.cache_info()['currsize'], 2)
+
+    def test_cache_invalidation(self):
+        bnet = create_montyhall_bayes_net()
+        bnet.enable_cache()
+        self.assertAlmostEqual(compute_probability(bnet, {'W': 'yes'}), 2/3)
+        bnet.get_factors()[0] = bnet.get_factors()[0].reduce({'C': '1'})
+        self.assertAlmostEqual(compute_probability(bnet, {'W': 'yes'}), 0.0)
+        self.assertEqual(bnet.cache_info()['hits'], 0)
+
+
+class TestEliminationOrder(unittest.TestCase):
+
+    def test_order_is_cached(self):
+        bnet = create_vampire_bayes_net()
+        self.assertIs(bnet.get_moral_graph(), bnet.get_moral_graph())
+        self.assertEqual(bnet.get_elimination_order(), compute_elimination_order(bnet)[0])
+
+    def test_query_specific_order(self):
+        bnet = create_vampire_bayes_net()
+        order = bnet.get_elimination_order(exclude={'X', 'Z_M'})
+        self.assertEqual(order, [var for var in bnet.get_elimination_order() if var not in {'X', 'Z_M'}])
+
+    def test_order_invalidation(self):
+        bnet = create_montyhall_bayes_net()
+        graph = bnet.get_moral_graph()
+        bnet.get_factors().pop()
+        self.assertIsNot(bnet.get_moral_graph(), graph)
+        self.assertNotIn('W', bnet.get_elimination_order())
+
+
+class TestEliminationHeuristics(unittest.TestCase):
+
+    def test_heuristics_agree(self):
+        for heuristic in ['min_degree', 'min_fill', 'weighted_min_fill', 'randomized']:
+            bnet = create_vampire_bayes_net()
+            bnet.set_elimination_heuristic(heuristic)
+            self.assertEqual(set(bnet.get_elimination_order()), bnet.get_variables())
+            prob = compute_conditional_probability(bnet, {'Y': 'AB'}, {'Z': 'AB', 'X': 'A'})
+            self.assertAlmostEqual(prob, 1/3)
+
+    def test_elimination_report(self):
+        bnet = create_vampire_bayes_net()
+        bnet.set_elimination_heuristic('weighted_min_fill')
+        report = bnet.elimination_report()
+        self.assertEqual(report, {'induced_width': 2, 'max_clique_size': 36})
+        bnet.set_elimination_heuristic('randomized', restarts=5, seed=0)
+        self.assertLessEqual(bnet.elimination_report()['max_clique_size'], report['max_clique_size'])
+
+    def test_unknown_heuristic(self):
+        bnet = create_vampire_bayes_net()
+        bnet.set_elimination_heuristic('max_degree')
+        with self.assertRaises(ValueError):
+            bnet.get_elimination_order()
+
+
+class TestEvidenceFirst(unittest.TestCase):
+
+    def test_condition(self):
+        bnet = create_vampire_bayes_net().condition({'Z': 'AB', 'X': 'A'})
+        self.assertNotIn('Z', bnet.get_variables())
+        self.assertNotIn('X', bnet.get_domains())
+        for factor in bnet.get_factors():
+            self.assertNotIn('Z', factor.get_variables())
+
+    def test_evidence_first_agrees(self):
+        bnet = create_vampire_bayes_net()
+        evidence = {'Z': 'AB', 'X': 'A'}
+        late = bnet.compute_conditional(['Y', 'Z_P'], evidence, evidence_first=False)
+        early = bnet.compute_conditional(['Y', 'Z_P'], evidence, evidence_first=True)
+        for y in ['A', 'B', 'AB', 'O']:
+            for z in ['A', 'B', 'O']:
+                event = {'Y': y, 'Z_P': z}
+                self.assertAlmostEqual(early.get_value(event), late.get_value(event))
+
+
+class TestPruning(unittest.TestCase):
+
+    def test_barren_nodes(self):
+        bnet = create_covid_bayes_net(3)
+        pruned = bnet.prune(['C_1'])
+        self.assertEqual(pruned.get_variables(), {'C_0', 'C_1'})
+        self.assertAlmostEqual(compute_probability(bnet, {'C_1': '+'}),
+                               bnet.compute_marginal(['C_1'], prune=True).get_value({'C_1': '+'}))
+
+    def test_d_separation(self):
+        bnet = create_covid_bayes_net(3)
+        pruned = bnet.prune(['C_3'], {'C_2': '+', 'T_1': '-'})
+        self.assertEqual(pruned.get_variables(), {'C_3'})
+
+    def test_pruned_conditional(self):
+        for bnet, vars, evidence in [(create_covid_bayes_net(3), ['C_1'], {'T_2': '+', 'C_3': '-'}),
+                                     (create_vampire_bayes_net(), ['Y'], {'Z': 'AB', 'X': 'A'}),
+                                     (create_montyhall_bayes_net(), ['W'], {'G': '2'})]:
+            for evidence_first in [True, False]:
+                expected = bnet.compute_conditional(vars, evidence, evidence_first=evidence_first)
+                pruned = bnet.compute_conditional(vars, evidence, evidence_first=evidence_first, prune=True)
+                for val in bnet.get_domains()[vars[0]]:
+                    self.assertAlmostEqual(pruned.get_value({vars[0]: val}),
+                                           expected.get_value({vars[0]: val}))
+
+    def test_query_variables_without_cpt(self):
+        # Y_M and Y_P have no CPT of their own, so dropping a barren child must not orphan them
+        bnet = create_vampire_bayes_net()
+        self.assertTrue({'X', 'Y_P'} <= bnet.prune(['X', 'Y_P']).get_variables())
+        marginal = bnet.compute_marginal(['X', 'Y_P'], prune=True)
+        self.assertEqual(set(marginal.get_variables()), {'X', 'Y_P'})
+        for vars, evidence in [(['X'], {'Y_P': 'A'}), (['Y_M'], {'Z_M': 'O', 'Y_P': 'A'})]:
+            for evidence_first in [True, False]:
+                expected = bnet.compute_conditional(vars, evidence, evidence_first=evidence_first)
+                pruned = bnet.compute_conditional(vars, evidence, evidence_first=evidence_first, prune=True)
+                self.assertEqual(pruned.get_variables(), vars)
+                for val in bnet.get_domains()[vars[0]]:
+                    self.assertAlmostEqual(pruned.get_value({vars[0]: val}),
+                                           expected.get_value({vars[0]: val}))
+
+
+class TestUnderflow(unittest.TestCase):
+
+    def test_many_rare_observations(self):
+        factors = [Factor(['Q'], {('a',): 0.5, ('b',): 0.5})]
+        domains = {'Q': ['a', 'b']}
+        for i in range(300):
+            factors.append(Factor(['Q', f'E_{i}'], {('a', '+'): 1e-3, ('a', '-'): 1 - 1e-3,
+                                                    ('b', '+'): 1.001e-3, ('b', '-'): 1 - 1.001e-3}))
+            domains[f'E_{i}'] = ['+', '-']
+        bnet = BayesianNetwork(factors, domains)
+        evidence = {f'E_{i}': '+' for i in range(300)}
+        prob = compute_conditional_probability(bnet, {'Q': 'a'}, evidence)
+        self.assertAlmostEqual(prob, 1 / (1 + 1.001 ** 300))
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_batch_matches_single_queries(self):
+        bnet = create_vampire_bayes_net()
+        evidence_list = [{'Z': 'AB', 'X': 'A'}, {'Z': 'O'}, {}, {'X': 'B'}]
+        results = bnet.compute_conditional_batch(['Y', 'Z_M'], evidence_list)
+        self.assertEqual(len(results), len(evidence_list))
+        for evidence, result in zip(evidence_list, results):
+            expected = bnet.compute_conditional(['Y', 'Z_M'], evidence)
+            for y in ['A', 'B', 'AB', 'O']:
+                for z in ['A', 'B', 'O']:
+                    event = {'Y': y, 'Z_M': z}
+                    self.assertAlmostEqual(result.get_value(event), expected.get_value(event))
+
+    def test_empty_batch(self):
+        self.assertEqual(create_vampire_bayes_net().compute_conditional_batch(['Y'], []), [])
+
+    def test_rows_of_different_scales(self):
+        factors = [Factor(['Q'], {('a',): 0.5, ('b',): 0.5})]
+        domains = {'Q': ['a', 'b']}
+        for i in range(300):
+            factors.append(Factor(['Q', f'E_{i}'], {('a', '+'): 1e-3, ('a', '-'): 1 - 1e-3,
+                                                    ('b', '+'): 1.001e-3, ('b', '-'): 1 - 1.001e-3}))
+            domains[f'E_{i}'] = ['+', '-']
+        bnet = BayesianNetwork(factors, domains)
+        evidence = {f'E_{i}': '+' for i in range(300)}
+        num_axes = len(factor._AXES)
+        for batch_size in [2, 3]:
+            results = bnet.compute_conditional_batch(['Q'], [evidence] + [{}] * (batch_size - 1))
+            self.assertAlmostEqual(results[0].get_value({'Q': 'a'}), 1 / (1 + 1.001 ** 300))
+            for result in results[1:]:
+                self.assertAlmostEqual(result.get_value({'Q': 'a'}), 0.5)
+        self.assertEqual(len(factor._AXES), num_axes)
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_ids(self):
+        bnet = create_montyhall_bayes_net()
+        registry = bnet.get_registry()
+        self.assertEqual(len(registry), len(bnet.get_domains()))
+        for var, domain in bnet.get_domains().items():
+            self.assertEqual(registry.get_variable(registry.get_id(var)), var)
+            self.assertEqual(registry.get_labels(var), tuple(domain))
+            for i, val in enumerate(domain):
+                self.assertEqual(registry.get_value_id(var, val), i)
+
+    def test_factors_are_encoded(self):
+        bnet = create_montyhall_bayes_net()
+        registry = bnet.get_registry()
+        for factor in bnet.get_factors():
+            for var, labels in zip(factor.get_variables(), factor.get_labels()):
+                self.assertIs(labels, registry.get_labels(var))
+
+    def test_encode_relabels(self):
+        registry = create_montyhall_bayes_net().get_registry()
+        factor = registry.encode(Factor(['G', 'W'], {('3', 'no'): 0.25, ('2', 'yes'): 0.75}))
+        self.assertEqual(factor.get_labels(), [('2', '3'), ('yes', 'no')])
+        self.assertAlmostEqual(factor.get_value({'G': '3', 'W': 'no'}), 0.25)
+        self.assertAlmostEqual(factor.get_value({'G': '2', 'W': 'yes'}), 0.75)
+        self.assertAlmostEqual(factor.get_value({'G': '2', 'W': 'no'}), 0.0)
+
+    def test_registry_is_shared(self):
+        bnet = create_vampire_bayes_net()
+        self.assertIs(bnet.eliminate('X').get_registry(), bnet.get_registry())
+        self.assertIs(bnet.condition({'Z': 'A'}).get_registry(), bnet.get_registry())
+
+
+class TestComponents(unittest.TestCase):
+
+    def test_components(self):
+        vampire, covid = create_vampire_bayes_net(), create_covid_bayes_net(3)
+        domains = dict(vampire.get_domains())
+        domains.update(covid.get_domains())
+        bnet = BayesianNetwork(vampire.get_factors() + covid.get_factors(), domains)
+        components = bnet.get_components()
+        self.assertEqual([component.get_variables() for component in components],
+                         [vampire.get_variables(), covid.get_variables()])
+        self.assertEqual([create_vampire_bayes_net().get_components()[0].get_variables()], [vampire.get_variables()])
+        self.assertIs(bnet.get_component(['X', 'Y']), components[0])
+        evidence = {'Z': 'AB', 'T_3': '+'}
+        result = bnet.compute_conditional(['C_1'], evidence)
+        expected = covid.compute_conditional(['C_1'], {'T_3': '+'})
+        for val in ['-', '+']:
+            self.assertAlmostEqual(result.get_value({'C_1': val}), expected.get_value({'C_1': val}))
+
+
 if __name__ == "__main__":
     unittest.main()   
\ No newline at end of file
@@ -1,6 +1,8 @@
 import unittest
+import tracemalloc
+import numpy as np
 import pandas as pd
-from factor import Factor, multiply_factors, events
+from factor import Factor, multiply_factors, sum_product, contraction_plan, events
 from montyhall import create_goat_cpt, create_finalchoice_cpt
 from vampire import create_inheritance_cpt
 
@@ -223,6 +225,132 @@ class TestFactor(unittest.TestCase):
             l_factor.get_value({'P': 'yeah', 'L': 'u'})
 
 
+class TestDenseFactor(unittest.TestCase):
+
+    def test_from_table(self):
+        factor = Factor.from_table(['P', 'L'], [('yes', 'no'), ('u', 'd')],
+                                   np.array([[0.1, 0.9], [0.99, 0.01]]))
+        _, _, l_factor = example_factors()
+        for p in ['yes', 'no']:
+            for l in ['u', 'd']:
+                self.assertEqual(factor.get_value({'P': p, 'L': l}),
+                                 l_factor.get_value({'P': p, 'L': l}))
+
+    def test_table_layout(self):
+        _, _, l_factor = example_factors()
+        self.assertEqual(l_factor.get_labels(), [('yes', 'no'), ('u', 'd')])
+        self.assertEqual(l_factor.get_table().shape, (2, 2))
+        self.assertEqual(l_factor.reduce({'L': 'd'}).get_table().shape, (2, 1))
+
+    def test_multiply_unaligned_labels(self):
+        domains = {'P': ['no', 'yes'], 'L': ['d', 'u']}
+        _, p_factor, l_factor = example_factors()
+        product = multiply_factors([l_factor, p_factor], domains)
+        self.assertEqual(product.get_labels(), [('no', 'yes'), ('d', 'u')])
+        self.assertAlmostEqual(product.get_value({'P': 'yes', 'L': 'u'}), .087)
+        self.assertAlmostEqual(product.get_value({'P': 'no', 'L': 'd'}), .0013)
+
+
+    def test_multiply_sparse(self):
+        domains = {'C': ['1', '2', '3'],
+                   'G': ['2', '3'],
+                   'F': ['1', '2', '3'],
+                   'W': ['yes', 'no']}
+        factors = [create_goat_cpt().reduce({'G': '3'}), create_finalchoice_cpt()]
+        dense = multiply_factors(factors, domains, sparse=False)
+        sparse = multiply_factors(factors, domains, sparse=True)
+        self.assertEqual(dense.get_variables(), sparse.get_variables())
+        for event in events(dense.get_variables(), domains):
+            self.assertAlmostEqual(dense.get_value(event), sparse.get_value(event))
+
+    def test_multiply_sparse_disjoint(self):
+        domains, p_factor, l_factor = example_factors()
+        product = multiply_factors([p_factor, l_factor.marginalize('P')], domains, sparse=True)
+        self.assertAlmostEqual(product.get_value({'P': 'yes', 'L': 'u'}), .87 * 1.09)
+        self.assertAlmostEqual(product.get_value({'P': 'no', 'L': 'd'}), .13 * .91)
+
+
+class TestSumProduct(unittest.TestCase):
+
+    def test_sum_product(self):
+        domains = {'C': ['1', '2', '3'],
+                   'G': ['2', '3'],
+                   'F': ['1', '2', '3'],
+                   'W': ['yes', 'no']}
+        factors = [create_goat_cpt(), create_finalchoice_cpt()]
+        product = multiply_factors(factors, domains)
+        for kept in [{'C', 'G', 'F', 'W'}, {'F', 'W'}, {'G'}, set()]:
+            expected = product
+            for var in product.get_variables():
+                if var not in kept:
+                    expected = expected.marginalize(var)
+            for sparse in [False, True]:
+                projected = sum_product(factors, domains, kept, sparse=sparse)
+                self.assertEqual(projected.get_variables(), expected.get_variables())
+                for event in events(expected.get_variables(), domains):
+                    self.assertAlmostEqual(projected.get_value(event), expected.get_value(event))
+
+    def test_sum_product_unaligned_labels(self):
+        domains = {'P': ['no', 'yes'], 'L': ['d', 'u']}
+        _, p_factor, l_factor = example_factors()
+        projected = sum_product([l_factor, p_factor], domains, {'L'})
+        self.assertEqual(projected.get_labels(), [('d', 'u')])
+        self.assertAlmostEqual(projected.get_value({'L': 'u'}), .087 + .13 * .99)
+
+
+    def test_sparse_sum_product_memory(self):
+        # a chain of deterministic factors is joined sparsely, straight onto the kept variables
+        labels = tuple(str(i) for i in range(10))
+        domains = {f'V{i}': list(labels) for i in range(7)}
+        factors = [Factor.from_table([f'V{i}', f'V{i + 1}'], [labels] * 2, np.eye(10)) for i in range(6)]
+        tracemalloc.start()
+        projected = sum_product(factors, domains, {'V0', 'V6'}, sparse=True)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertLess(peak, 1000000)
+        self.assertEqual(projected.get_variables(), ['V0', 'V6'])
+        self.assertTrue(np.allclose(projected.get_table() * np.exp(projected.get_log_scale()), np.eye(10)))
+
+    def test_contraction_plan(self):
+        plan = contraction_plan(((0, 1), (1, 2), (2, 3)), (2, 3, 4, 2), (0,))
+        self.assertEqual(len(plan), 2)
+        self.assertEqual(plan[-1][1], (0,))
+        self.assertIs(contraction_plan(((0, 1), (1, 2), (2, 3)), (2, 3, 4, 2), (0,)), plan)
+
+    def test_sum_product_chain(self):
+        domains = {f'X{i}': ['a', 'b', 'c'] for i in range(8)}
+        rng = np.random.default_rng(0)
+        factors = [Factor.from_table([f'X{i}', f'X{i + 1}'], [('a', 'b', 'c')] * 2, rng.random((3, 3)))
+                   for i in range(7)]
+        projected = sum_product(factors, domains, {'X0', 'X7'})
+        expected = multiply_factors(factors, domains)
+        for var in expected.get_variables():
+            if var not in ('X0', 'X7'):
+                expected = expected.marginalize(var)
+        for event in events(['X0', 'X7'], domains):
+            self.assertAlmostEqual(projected.get_value(event), expected.get_value(event))
+
+
+class TestScaling(unittest.TestCase):
+
+    def test_rescale(self):
+        _, _, l_factor = example_factors()
+        scaled = l_factor.rescale()
+        self.assertEqual(scaled.get_table().max(), 1.0)
+        self.assertAlmostEqual(scaled.get_value({'P': 'no', 'L': 'u'}), .99)
+        self.assertAlmostEqual(scaled.get_log_value({'P': 'yes', 'L': 'u'}), np.log(.1))
+
+    def test_product_does_not_underflow(self):
+        domains = {'P': ['yes', 'no']}
+        factor = Factor(['P'], {('yes',): 1e-5, ('no',): 3e-5})
+        product = multiply_factors([factor] * 100, domains)
+        self.assertAlmostEqual(product.get_log_value({'P': 'yes'}), 100 * np.log(1e-5))
+        self.assertAlmostEqual(product.get_log_value({'P': 'no'}), 100 * np.log(3e-5))
+        self.assertAlmostEqual(product.normalize().get_value({'P': 'yes'}), 1 / (1 + 3 ** 100))
+        sparse = multiply_factors([factor] * 100, domains, sparse=True)
+        self.assertAlmostEqual(sparse.get_log_value({'P': 'no'}), 100 * np.log(3e-5))
+        projected = sum_product([factor] * 30, domains, {'P'})
+        self.assertAlmostEqual(projected.get_log_value({'P': 'no'}), 30 * np.log(3e-5))
 
 
 if __name__ == "__main__":
@@ -159,6 +159,40 @@ class TestNine(unittest.TestCase):
         self.assertAlmostEqual(cpt.get_value({'G_nicholas': 'Xy', 'P_anastasia': 'X'}), 1.0)
 
 
+class TestCptTemplates(unittest.TestCase):
+
+    def test_tables_are_shared(self):
+        alexandra, nicholas, alexey, anastasia = romanoffs()
+        self.assertIs(create_hemophilia_cpt(nicholas).get_table(), create_hemophilia_cpt(alexey).get_table())
+        self.assertIs(create_genotype_cpt(alexandra).get_table(), create_genotype_cpt(anastasia).get_table())
+        self.assertIs(create_maternal_inheritance_cpt(alexey).get_table(),
+                      create_maternal_inheritance_cpt(anastasia).get_table())
+
+    def test_tables_are_read_only(self):
+        alexandra, nicholas, alexey, anastasia = romanoffs()
+        table = create_genotype_cpt(anastasia).get_table()
+        self.assertFalse(table.flags.writeable)
+        with self.assertRaises(ValueError):
+            table[0, 0, 0] = 0.5
+
+    def test_labels_are_shared(self):
+        alexandra, nicholas, alexey, anastasia = romanoffs()
+        cpt1 = create_hemophilia_cpt(nicholas)
+        cpt2 = create_hemophilia_cpt(alexey)
+        self.assertIs(cpt1.get_labels()[0], cpt2.get_labels()[0])
+        self.assertIs(cpt1._index[1], cpt2._index[1])
+        self.assertFalse(hasattr(cpt1, '__dict__'))
+
+    def test_cpts_are_normalized(self):
+        for person in romanoffs():
+            for create_cpt in [create_hemophilia_cpt, create_genotype_cpt,
+                               create_maternal_inheritance_cpt, create_paternal_inheritance_cpt]:
+                cpt = create_cpt(person)
+                child = cpt.get_variables()[-1] if create_cpt in [create_hemophilia_cpt, create_genotype_cpt] \
+                    else cpt.get_variables()[0]
+                for value in cpt.marginalize(child).get_table().flatten():
+                    self.assertAlmostEqual(value, 1.0)
+
 
 class TestRomanoffs(unittest.TestCase):
 
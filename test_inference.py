@@ -1,10 +1,14 @@
 import unittest
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from montyhall import create_montyhall_bayes_net
 from covid import create_covid_bayes_net
 from vampire import create_vampire_bayes_net
 from util import UndirectedGraph, build_junction_tree
-from inference import count_nodes, compute_separators, message_passing
-from inference import belief_propagation
+from inference import count_nodes, compute_separators, message_passing, parallel_message_passing
+from inference import belief_propagation, CompiledNetwork, collect_distribute_schedule
+from inference import belief_propagation_batch, DecomposedNetwork
+from bayes import BayesianNetwork
+from factor import Factor
 
 def compute_probability(bnet, event):
     return bnet.compute_marginal(event.keys()).get_value(event)
@@ -36,11 +40,51 @@ class TestMessagePassing(unittest.TestCase):
                     (3, 7): {'C', 'E', 'B', 'A', 'D'}}
         self.assertEqual(messages, expected)
 
+    def test_parallel_message_passing(self):
+        msgs = {1: {'C', 'E'}, 4: {'B', 'D'} , 5: {'A', 'B'} , 6: {'B', 'C'} , 7: {'A'}}
+        tree = UndirectedGraph(8, [(0, 2), (0, 3), (0, 4), (1, 2), (2, 6), (3, 5), (3, 7)])
+        compute_msg = lambda s, d, incoming: set.union(*incoming)
+        expected = message_passing(tree, lambda leaf: msgs[leaf], compute_msg)
+        messages = parallel_message_passing(tree, lambda leaf: msgs[leaf], compute_msg, max_workers=4)
+        self.assertEqual(messages, expected)
+
     def test_message_passing2(self):
         bnet = create_montyhall_bayes_net()
         jtree = build_junction_tree(bnet)
         self.assertEqual(count_nodes(jtree), 6)
 
+    def test_message_schedule(self):
+        tree = UndirectedGraph(8, [(0, 2), (0, 3), (0, 4), (1, 2), (2, 6), (3, 5), (3, 7)])
+        schedule = tree.get_message_schedule()
+        self.assertIs(tree.get_message_schedule(), schedule)
+        self.assertEqual(len(schedule), 14)
+        for position, (src, dest, incoming) in enumerate(schedule):
+            self.assertTrue(all(index < position for index in incoming))
+            self.assertEqual({schedule[index][:2] for index in incoming},
+                             {(neighbor, src) for neighbor in tree.get_neighbors(src) if neighbor != dest})
+        tree.add_edge(7, tree.add_node())
+        self.assertEqual(len(tree.get_message_schedule()), 16)
+
+    def test_graph_updates(self):
+        graph = UndirectedGraph(4, [(0, 1), (1, 2)], ['a', 'b', 'c', 'd'])
+        self.assertEqual(set(graph.get_neighbors(1)), {0, 2})
+        self.assertEqual(graph.get_degree(3), 0)
+        graph.add_edge(3, 1)
+        self.assertEqual(set(graph.get_neighbors(1)), {0, 2, 3})
+        self.assertEqual(graph.get_degree(1), 3)
+        self.assertEqual(graph.get_edges(), [(0, 1), (1, 2), (1, 3)])
+        graph.remove_node(0)
+        self.assertEqual(graph.get_num_nodes(), 3)
+        self.assertEqual(graph.get_edges(), [(0, 1), (0, 2)])
+        self.assertEqual([graph.get_node_label(node) for node in range(3)], ['b', 'c', 'd'])
+        self.assertTrue(graph.is_leaf(2))
+        pruned = graph.prune_leaf(2)
+        self.assertEqual(pruned.get_edges(), [(0, 1)])
+        self.assertEqual(graph.get_edges(), [(0, 1), (0, 2)])
+        graph = UndirectedGraph(3, [('A', 'B')], ['A', 'B', 'C'], nodes=['A', 'B', 'C'])
+        self.assertEqual(graph.get_adjacencies()['C'], set())
+        self.assertEqual(graph.get_neighbors('C'), ())
+
 
 class TestTen(unittest.TestCase):
 
@@ -85,6 +129,13 @@ class TestTen(unittest.TestCase):
         self.assertEqual(separators[(4, 5)], {'Z_P', 'Z_M'})
         self.assertEqual(separators[(5, 4)], {'Z_P', 'Z_M'})
 
+    def test_separators_are_stored(self):
+        jtree = build_junction_tree(create_covid_bayes_net(2))
+        separators = compute_separators(jtree)
+        self.assertIs(jtree.get_separators(), separators)
+        self.assertIs(compute_separators(jtree), separators)
+        self.assertEqual(jtree.get_separator(2, 6), {'C_1', 'C_2'})
+
 
 class TestEleven(unittest.TestCase):
 
@@ -136,5 +187,193 @@ class TestEleven(unittest.TestCase):
 
 
 
+class TestCompiledNetwork(unittest.TestCase):
+
+    def test_repeated_queries(self):
+        bnet = create_vampire_bayes_net()
+        compiled = CompiledNetwork(bnet)
+        for evidence in [{'Z': 'AB', 'X': 'A'}, {'Z': 'O'}, {}]:
+            marginals = compiled.query(evidence)
+            for var in ['X_M', 'Y', 'Z_P']:
+                expected = bnet.compute_conditional([var], evidence)
+                for val in bnet.get_domains()[var]:
+                    self.assertAlmostEqual(marginals[var].get_value({var: val}),
+                                           expected.get_value({var: val}))
+
+    def test_junction_tree_is_reused(self):
+        compiled = CompiledNetwork(create_covid_bayes_net(3))
+        jtree = compiled.get_junction_tree()
+        compiled.query({'T_3': '+'})
+        compiled.query({'T_1': '-'})
+        self.assertIs(compiled.get_junction_tree(), jtree)
+
+    def test_evidence_as_likelihood(self):
+        marginals = CompiledNetwork(create_covid_bayes_net(3)).query({'T_3': '+'})
+        self.assertAlmostEqual(marginals['T_3'].get_value({'T_3': '-'}), 0.0)
+        self.assertAlmostEqual(marginals['T_3'].get_value({'T_3': '+'}), 1.0)
+
+    def test_elimination_junction_tree(self):
+        bnet = create_covid_bayes_net(3)
+        jtree = build_junction_tree(bnet, method='elimination')
+        self.assertEqual(len(jtree.get_edges()), jtree.get_num_nodes() - 1)
+        expected = CompiledNetwork(bnet).query({'T_3': '+'})
+        marginals = CompiledNetwork(bnet, method='elimination').query({'T_3': '+'})
+        for var in expected:
+            for val in ['-', '+']:
+                self.assertAlmostEqual(marginals[var].get_value({var: val}),
+                                       expected[var].get_value({var: val}))
+
+    def test_collect_distribute_schedule(self):
+        jtree = build_junction_tree(create_vampire_bayes_net())
+        schedule = collect_distribute_schedule(jtree)
+        self.assertEqual(len(schedule), 2 * len(jtree.get_edges()))
+        sent = set()
+        for (src, dest, incoming) in schedule:
+            for edge in incoming:
+                self.assertIn(edge, sent)
+            sent.add((src, dest))
+
+    def test_bp_with_pruning(self):
+        bnet = create_covid_bayes_net(3)
+        marginals = belief_propagation(bnet, {'T_3': '+'}, query=['C_1', 'C_2'])
+        self.assertEqual(set(marginals), {'C_1', 'C_2'})
+        self.assertAlmostEqual(marginals['C_1'].get_value({'C_1': '+'}), 0.38463069287988005)
+        self.assertAlmostEqual(marginals['C_2'].get_value({'C_2': '+'}), 0.6052685915971165)
+        # Y_M only appears in the CPTs of its children, which pruning must not all drop
+        bnet = create_vampire_bayes_net()
+        marginals = belief_propagation(bnet, {'Z_M': 'O', 'Y_P': 'A'}, query=['Y_M'])
+        expected = bnet.compute_conditional(['Y_M'], {'Z_M': 'O', 'Y_P': 'A'})
+        for val in bnet.get_domains()['Y_M']:
+            self.assertAlmostEqual(marginals['Y_M'].get_value({'Y_M': val}), expected.get_value({'Y_M': val}))
+        # an observed query variable is pruned away, but still gets its (point mass) distribution
+        bnet = create_covid_bayes_net(3)
+        for query in [['T_3'], ['T_3', 'C_2']]:
+            marginals = belief_propagation(bnet, {'T_3': '+'}, query=query)
+            self.assertEqual(set(marginals), set(query))
+            self.assertEqual(marginals['T_3'].get_value({'T_3': '+'}), 1.0)
+            self.assertEqual(marginals['T_3'].get_value({'T_3': '-'}), 0.0)
+        self.assertAlmostEqual(marginals['C_2'].get_value({'C_2': '+'}), 0.6052685915971165)
+
+    def test_incremental_evidence(self):
+        compiled = CompiledNetwork(create_vampire_bayes_net())
+        steps = [('set', 'Z', 'AB'), ('set', 'X', 'A'), ('set', 'Z', 'A'), ('retract', 'X', None)]
+        for action, var, value in steps:
+            if action == 'set':
+                compiled.set_evidence(var, value)
+            else:
+                compiled.retract_evidence(var)
+            expected = compiled.query(compiled.get_evidence())
+            for target in ['X_M', 'Y', 'Z_P']:
+                marginal = compiled.get_marginal(target)
+                for val in compiled.get_network().get_domains()[target]:
+                    self.assertAlmostEqual(marginal.get_value({target: val}),
+                                           expected[target].get_value({target: val}))
+
+    def test_marginals_share_beliefs(self):
+        compiled = CompiledNetwork(create_vampire_bayes_net())
+        compiled.set_evidence('Z', 'AB')
+        nodes = []
+        belief = compiled._belief
+        compiled._belief = lambda node, *args: nodes.append(node) or belief(node, *args)
+        marginals = compiled.get_marginals()
+        self.assertEqual(len(nodes), len(set(nodes)))
+        expected = compiled.query({'Z': 'AB'})
+        for var in expected:
+            for val in compiled.get_network().get_domains()[var]:
+                self.assertAlmostEqual(marginals[var].get_value({var: val}), expected[var].get_value({var: val}))
+
+    def test_update_evidence(self):
+        compiled = CompiledNetwork(create_covid_bayes_net(3))
+        compiled.update_evidence({'T_1': '-', 'T_3': '+'})
+        compiled.update_evidence({'T_3': '+'})
+        self.assertEqual(compiled.get_evidence(), {'T_3': '+'})
+        marginals = compiled.get_marginals()
+        self.assertAlmostEqual(marginals['C_0'].get_value({'C_0': '+'}), 0.1837846966375946)
+        self.assertAlmostEqual(marginals['T_1'].get_value({'T_1': '+'}), 0.31078140083950473)
+
+    def test_query_batch(self):
+        bnet = create_covid_bayes_net(3)
+        evidence_list = [{'T_3': '+'}, {'T_1': '-', 'T_2': '+'}, {}]
+        results = belief_propagation_batch(bnet, evidence_list)
+        for evidence, result in zip(evidence_list, results):
+            expected = belief_propagation(bnet, evidence)
+            self.assertEqual(set(result), set(expected))
+            for var in expected:
+                for val in ['-', '+']:
+                    self.assertAlmostEqual(result[var].get_value({var: val}),
+                                           expected[var].get_value({var: val}))
+
+    def test_query_batch_rows_of_different_scales(self):
+        factors = [Factor(['Q'], {('a',): 0.5, ('b',): 0.5})]
+        domains = {'Q': ['a', 'b']}
+        for i in range(300):
+            factors.append(Factor(['Q', f'E_{i}'], {('a', '+'): 1e-3, ('a', '-'): 1 - 1e-3,
+                                                    ('b', '+'): 1.001e-3, ('b', '-'): 1 - 1.001e-3}))
+            domains[f'E_{i}'] = ['+', '-']
+        bnet = BayesianNetwork(factors, domains)
+        evidence = {f'E_{i}': '+' for i in range(300)}
+        results = CompiledNetwork(bnet).query_batch([evidence, {}])
+        self.assertAlmostEqual(results[0]['Q'].get_value({'Q': 'a'}), 1 / (1 + 1.001 ** 300))
+        self.assertAlmostEqual(results[1]['Q'].get_value({'Q': 'a'}), 0.5)
+
+    def test_parallel_calibration(self):
+        compiled = CompiledNetwork(create_vampire_bayes_net())
+        evidence = {'Z': 'AB', 'X': 'A'}
+        expected = compiled.query(evidence)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            marginals = compiled.query(evidence, executor)
+        for var in expected:
+            for val in compiled.get_network().get_domains()[var]:
+                self.assertAlmostEqual(marginals[var].get_value({var: val}),
+                                       expected[var].get_value({var: val}))
+
+    def test_process_executor_is_rejected(self):
+        bnet = create_vampire_bayes_net()
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(ValueError):
+                CompiledNetwork(bnet).query({'X': 'A'}, executor)
+            with self.assertRaises(ValueError):
+                DecomposedNetwork(bnet).query({'X': 'A'}, executor=executor)
+
+
+class TestDecomposedNetwork(unittest.TestCase):
+
+    def create_network(self):
+        vampire, covid = create_vampire_bayes_net(), create_covid_bayes_net(3)
+        domains = dict(vampire.get_domains())
+        domains.update(covid.get_domains())
+        return BayesianNetwork(vampire.get_factors() + covid.get_factors(), domains), vampire, covid
+
+    def test_query(self):
+        bnet, vampire, covid = self.create_network()
+        decomposed = DecomposedNetwork(bnet)
+        evidence = {'Z': 'AB', 'T_3': '+'}
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            marginals = decomposed.query(evidence, executor=executor)
+        self.assertEqual(set(marginals), vampire.get_variables() | covid.get_variables())
+        for part in [vampire, covid]:
+            expected = belief_propagation(part, {var: val for var, val in evidence.items() if var in part.get_variables()})
+            for var in part.get_variables():
+                for val in part.get_domains()[var]:
+                    self.assertAlmostEqual(marginals[var].get_value({var: val}),
+                                           expected[var].get_value({var: val}))
+
+    def test_only_queried_components_are_compiled(self):
+        bnet, vampire, covid = self.create_network()
+        decomposed = DecomposedNetwork(bnet)
+        marginals = decomposed.query({'T_3': '+', 'Z': 'AB'}, vars=['C_1'])
+        self.assertAlmostEqual(marginals['C_1'].get_value({'C_1': '+'}), 0.38463069287988005)
+        self.assertNotIn('X', marginals)
+        self.assertEqual(sum(compiled is not None for compiled in decomposed._compiled), 1)
+
+    def test_incremental_evidence(self):
+        bnet, vampire, covid = self.create_network()
+        decomposed = DecomposedNetwork(bnet)
+        decomposed.update_evidence({'T_3': '+', 'Z': 'AB'})
+        decomposed.update_evidence({'T_3': '+'})
+        self.assertEqual(decomposed.get_evidence(), {'T_3': '+'})
+        self.assertAlmostEqual(decomposed.get_marginal('C_1').get_value({'C_1': '+'}), 0.38463069287988005)
+
+
 if __name__ == "__main__":
     unittest.main()   
\ No newline at end of file
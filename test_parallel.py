@@ -0,0 +1,50 @@
+import unittest
+import pickle
+from vampire import create_vampire_bayes_net
+from covid import create_covid_bayes_net
+from inference import belief_propagation
+from parallel import ParallelQueryRunner
+
+
+class TestParallelQueryRunner(unittest.TestCase):
+
+    def test_compute_conditional(self):
+        bnet = create_vampire_bayes_net()
+        queries = [(['Y'], {'Z': 'AB', 'X': 'A'}), (['X_M'], {'Z': 'O'}), (['Z'], {})]
+        with ParallelQueryRunner(bnet, max_workers=2) as runner:
+            results = list(runner.compute_conditional(queries))
+        for (vars, evidence), result in zip(queries, results):
+            expected = bnet.compute_conditional(vars, evidence)
+            for val in bnet.get_domains()[vars[0]]:
+                self.assertAlmostEqual(result.get_value({vars[0]: val}),
+                                       expected.get_value({vars[0]: val}))
+
+    def test_belief_propagation(self):
+        bnet = create_covid_bayes_net(3)
+        evidence_list = [{'T_3': '+'}, {'T_1': '-'}]
+        with ParallelQueryRunner(bnet, max_workers=2) as runner:
+            results = list(runner.belief_propagation(evidence_list))
+        for evidence, result in zip(evidence_list, results):
+            expected = belief_propagation(bnet, evidence)
+            for var in expected:
+                self.assertAlmostEqual(result[var].get_value({var: '+'}),
+                                       expected[var].get_value({var: '+'}))
+
+    def test_pickled_network(self):
+        bnet = create_vampire_bayes_net()
+        bnet.enable_cache()
+        bnet.compute_marginal(['Z'])
+        copy = pickle.loads(pickle.dumps(bnet))
+        self.assertEqual(copy.cache_info()['currsize'], 0)
+        self.assertAlmostEqual(copy.compute_marginal(['Z']).get_value({'Z': 'AB'}), 2/9)
+
+    def test_pickled_network_drops_structure(self):
+        bnet = create_vampire_bayes_net()
+        fresh = len(pickle.dumps(bnet))
+        bnet.compute_marginal(['Z'])
+        bnet.get_components()
+        self.assertEqual(len(pickle.dumps(bnet)), fresh)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from genetics import create_family_bayes_net, romanoffs
+from pedigree import read_pedigree, load_pedigree, PedigreeBuilder
+
+
+# The Romanoffs (see genetics.romanoffs), with the children listed before their parents.
+ROMANOFFS_FAM = """ROM alexey nicholas alexandra 1 2
+ROM anastasia nicholas alexandra 2 0
+ROM alexandra 0 0 2 1
+ROM nicholas 0 0 1 -9
+"""
+
+ROMANOFFS_CSV = """id,mother,father,sex,phenotype
+alexey,alexandra,nicholas,male,2
+anastasia,alexandra,nicholas,female,
+alexandra,,,female,1
+nicholas,,,male,0
+"""
+
+
+class TestPedigree(unittest.TestCase):
+
+    def write_file(self, contents, suffix):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as f:
+            f.write(contents)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_read_fam(self):
+        records = list(read_pedigree(self.write_file(ROMANOFFS_FAM, '.fam')))
+        self.assertEqual([record.id for record in records], ['alexey', 'anastasia', 'alexandra', 'nicholas'])
+        self.assertEqual(records[0].family, 'ROM')
+        self.assertEqual((records[0].father, records[0].mother), ('nicholas', 'alexandra'))
+        self.assertEqual(records[1].sex, 'female')
+        self.assertEqual([record.phenotype for record in records], ['+', None, '-', None])
+        self.assertIsNone(records[2].mother)
+
+    def test_load_fam(self):
+        bnet, evidence, members = load_pedigree(self.write_file(ROMANOFFS_FAM, '.fam'))
+        self.assertEqual(evidence, {'H_ROM.alexey': '+', 'H_ROM.alexandra': '-'})
+        self.assertIs(members['ROM.alexey'].mother, members['ROM.alexandra'])
+        expected = create_family_bayes_net(romanoffs()).compute_conditional(
+            ['G_anastasia'], {'H_alexey': '+', 'H_alexandra': '-'})
+        result = bnet.compute_conditional(['G_ROM.anastasia'], evidence)
+        for val in ['xx', 'xX', 'XX']:
+            self.assertAlmostEqual(result.get_value({'G_ROM.anastasia': val}),
+                                   expected.get_value({'G_anastasia': val}))
+
+    def test_load_csv(self):
+        bnet, evidence, members = load_pedigree(self.write_file(ROMANOFFS_CSV, '.csv'))
+        self.assertEqual(evidence, {'H_alexey': '+', 'H_alexandra': '-'})
+        self.assertEqual(len(bnet.get_factors()), len(create_family_bayes_net(romanoffs()).get_factors()))
+        self.assertAlmostEqual(bnet.compute_conditional(['G_anastasia'], evidence).get_value({'G_anastasia': 'xX'}),
+                               0.5000166655555557, places=3)
+
+    def test_missing_parents_are_founders(self):
+        path = self.write_file("F1 child dad mom 2 0\nF1 mom 0 0 2 0\n", '.ped')
+        bnet, evidence, members = load_pedigree(path)
+        self.assertIsNone(members['F1.child'].father)
+        self.assertAlmostEqual(bnet.compute_marginal(['P_F1.child']).get_value({'P_F1.child': 'X'}), 1/30000)
+
+    def test_invalid_rows(self):
+        builder = PedigreeBuilder()
+        with self.assertRaises(ValueError):
+            list(read_pedigree(self.write_file("F1 a 0 0 0 1\n", '.fam')))
+        records = list(read_pedigree(self.write_file("F1 a 0 0 1 1\nF1 b 0 a 2 1\n", '.fam')))
+        builder.add(records[0])
+        with self.assertRaises(ValueError):
+            builder.add(records[1])
+        with self.assertRaises(ValueError):
+            builder.add(records[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
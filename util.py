@@ -1,9 +1,249 @@
+import heapq
+import random
 from collections import defaultdict
 import numpy as np
+from scipy.sparse import csr_matrix
 from scipy.sparse.csgraph import minimum_spanning_tree
 from junction import JunctionTree
 
-def compute_elimination_order(bnet):
+def build_moral_graph(bnet):
+    """Builds the moral graph of a Bayesian network.
+
+    Two variables are adjacent in the moral graph if they appear together in some factor.
+
+    Parameters
+    ----------
+    bnet : BayesianNetwork
+        the Bayesian network
+
+    Returns
+    -------
+    UndirectedGraph
+        the moral graph, whose nodes are the variables of the Bayesian network
+    """
+
+    node_labels = [var for var in bnet.get_variables()]
+    edges = []
+    for factor in bnet.get_factors():
+        vars = [v for v in factor.get_variables()]
+        for i, var in enumerate(vars):
+            edges += [(var, neighbor) for neighbor in vars[:i] + vars[i + 1:]]
+    # variables that share no factor with any other variable are isolated nodes
+    nodes = [var for factor in bnet.get_factors() for var in factor.get_variables()]
+    return UndirectedGraph(len(node_labels), edges, node_labels, nodes)
+
+
+def min_degree_elim_order(moral_graph):
+    """Orders the nodes of a graph by repeatedly removing a node of minimum degree.
+
+    Degrees are kept in a priority queue and updated incrementally as nodes are
+    removed. Ties are broken in favor of the node that comes first in the graph's
+    adjacency dictionary.
+
+    Parameters
+    ----------
+    moral_graph : UndirectedGraph
+        the graph to order (it is not modified)
+
+    Returns
+    -------
+    list[str]
+        the nodes of the graph, in elimination order
+    """
+
+    adjacencies = moral_graph.get_adjacencies()
+    position = {node: i for i, node in enumerate(adjacencies)}
+    degree = {node: len(adjacencies[node]) for node in adjacencies}
+    queue = [(degree[node], position[node], node) for node in adjacencies]
+    heapq.heapify(queue)
+    eliminated = set()
+    elim_order = []
+    while len(queue) > 0:
+        node_degree, _, node = heapq.heappop(queue)
+        if node in eliminated or node_degree != degree[node]:
+            continue  # a stale entry
+        eliminated.add(node)
+        elim_order.append(node)
+        for neighbor in adjacencies[node]:
+            if neighbor not in eliminated:
+                degree[neighbor] -= 1
+                heapq.heappush(queue, (degree[neighbor], position[neighbor], neighbor))
+    return elim_order
+
+
+def fill_in_elim_order(moral_graph, domains, weighted=False, rng=None):
+    """Orders the nodes of a graph by repeatedly eliminating the node that adds the fewest fill-in edges.
+
+    Eliminating a node connects all of its remaining neighbors. The cost of a node is
+    the number of such edges that are not already in the graph (min-fill), or, if
+    weighted is True, the sum over those edges of the product of the domain sizes of
+    their endpoints (weighted min-fill). Costs are kept in a priority queue and only
+    recomputed for the nodes near each eliminated node.
+
+    Parameters
+    ----------
+    moral_graph : UndirectedGraph
+        the graph to order (it is not modified)
+    domains : dict[str, list[str]]
+        a dictionary mapping each variable to its possible values
+    weighted : bool
+        whether to weight the fill-in edges by domain size
+    rng : random.Random
+        if provided, ties are broken randomly instead of by adjacency order
+
+    Returns
+    -------
+    list[str]
+        the nodes of the graph, in elimination order
+    """
+
+    adjacencies = {node: set(neighbors) for node, neighbors in moral_graph.get_adjacencies().items()}
+    position = {node: i for i, node in enumerate(adjacencies)}
+
+    def weight(node):
+        return len(domains[node]) if weighted else 1
+
+    def fill_cost(node):
+        neighbors = list(adjacencies[node])
+        cost = 0
+        for i, node1 in enumerate(neighbors):
+            for node2 in neighbors[i + 1:]:
+                if node2 not in adjacencies[node1]:
+                    cost += weight(node1) * weight(node2)
+        return cost
+
+    def entry(node):
+        tiebreak = rng.random() if rng is not None else position[node]
+        return (cost[node], len(adjacencies[node]), tiebreak, node)
+
+    cost = {node: fill_cost(node) for node in adjacencies}
+    queue = [entry(node) for node in adjacencies]
+    heapq.heapify(queue)
+    elim_order = []
+    while len(queue) > 0:
+        node_cost, node_degree, _, node = heapq.heappop(queue)
+        if node not in adjacencies or node_cost != cost[node] or node_degree != len(adjacencies[node]):
+            continue  # a stale entry
+        neighbors = adjacencies.pop(node)
+        elim_order.append(node)
+        for neighbor in neighbors:
+            adjacencies[neighbor].discard(node)
+            adjacencies[neighbor] |= neighbors - {neighbor}
+        # only the neighbors and their neighbors can have a different cost now
+        affected = set(neighbors)
+        for neighbor in neighbors:
+            affected |= adjacencies[neighbor]
+        for other in affected:
+            cost[other] = fill_cost(other)
+            heapq.heappush(queue, entry(other))
+    return elim_order
+
+
+def randomized_elim_order(moral_graph, domains, restarts=10, seed=None):
+    """Runs weighted min-fill several times with random tie-breaking, and keeps the best order.
+
+    The first run breaks ties by adjacency order, so the result is never worse than
+    plain weighted min-fill. Orders are compared by the size of their largest clique
+    table, then by their induced width.
+
+    Parameters
+    ----------
+    moral_graph : UndirectedGraph
+        the graph to order (it is not modified)
+    domains : dict[str, list[str]]
+        a dictionary mapping each variable to its possible values
+    restarts : int
+        the number of randomized runs (in addition to the first one)
+    seed : int
+        the seed of the random number generator
+
+    Returns
+    -------
+    list[str]
+        the nodes of the graph, in elimination order
+    """
+
+    rng = random.Random(seed)
+    best, best_score = None, None
+    for restart in range(restarts + 1):
+        order = fill_in_elim_order(moral_graph, domains, weighted=True, rng=rng if restart > 0 else None)
+        report = elimination_width(moral_graph, order, domains)
+        score = (report['max_clique_size'], report['induced_width'])
+        if best_score is None or score < best_score:
+            best, best_score = order, score
+    return best
+
+
+def elimination_width(moral_graph, elim_order, domains):
+    """Reports the cost of eliminating the nodes of a graph in a particular order.
+
+    Parameters
+    ----------
+    moral_graph : UndirectedGraph
+        the graph (it is not modified)
+    elim_order : list[str]
+        the elimination order
+    domains : dict[str, list[str]]
+        a dictionary mapping each variable to its possible values
+
+    Returns
+    -------
+    dict[str, int]
+        the induced width of the order (the size of its largest clique, minus one) and
+        the number of entries in its largest clique table
+    """
+
+    adjacencies = {node: set(neighbors) for node, neighbors in moral_graph.get_adjacencies().items()}
+    width, max_size = 0, 1
+    for node in elim_order:
+        neighbors = adjacencies.pop(node)
+        size = len(domains[node])
+        for neighbor in neighbors:
+            size *= len(domains[neighbor])
+            adjacencies[neighbor].discard(node)
+            adjacencies[neighbor] |= neighbors - {neighbor}
+        width = max(width, len(neighbors))
+        max_size = max(max_size, size)
+    return {'induced_width': width, 'max_clique_size': max_size}
+
+
+ELIMINATION_HEURISTICS = ('min_degree', 'min_fill', 'weighted_min_fill', 'randomized')
+
+def elimination_order(moral_graph, domains, heuristic='min_degree', restarts=10, seed=None):
+    """Computes an elimination order for a moral graph using the specified heuristic.
+
+    Parameters
+    ----------
+    moral_graph : UndirectedGraph
+        the moral graph of a Bayesian network
+    domains : dict[str, list[str]]
+        a dictionary mapping each variable to its possible values
+    heuristic : str
+        one of 'min_degree', 'min_fill', 'weighted_min_fill' or 'randomized'
+    restarts : int
+        the number of restarts of the randomized heuristic
+    seed : int
+        the seed of the randomized heuristic
+
+    Returns
+    -------
+    list[str]
+        the elimination order
+    """
+
+    if heuristic == 'min_degree':
+        return min_degree_elim_order(moral_graph)
+    elif heuristic == 'min_fill':
+        return fill_in_elim_order(moral_graph, domains)
+    elif heuristic == 'weighted_min_fill':
+        return fill_in_elim_order(moral_graph, domains, weighted=True)
+    elif heuristic == 'randomized':
+        return randomized_elim_order(moral_graph, domains, restarts, seed)
+    else:
+        raise ValueError(f'Unknown elimination heuristic {heuristic}.')
+
+
+def compute_elimination_order(bnet, heuristic='min_degree', **options):
     """Computes a low-width elimination order for a Bayesian network.
 
     YOU DO NOT NEED TO UNDERSTAND HOW THIS FUNCTION WORKS.
@@ -12,6 +252,8 @@ def compute_elimination_order(bnet):
     ----------
     bnet : BayesianNetwork
         the Bayesian network for which to compute the elimination order
+    heuristic : str
+        the heuristic to use (see elimination_order)
 
     Returns
     -------
@@ -19,35 +261,11 @@ def compute_elimination_order(bnet):
         the elimination order (a list of the variables of the Bayesian network)
     """
 
-    def build_moral_graph(bnet):
-        node_labels = [var for var in bnet.get_variables()]
-        edges = []
-        for factor in bnet.get_factors():
-            vars = [v for v in factor.get_variables()]
-            for i, var in enumerate(vars):
-                edges += [(var, neighbor) for neighbor in vars[:i] + vars[i + 1:]]
-        return UndirectedGraph(len(node_labels), edges, node_labels)
-
-    def min_degree_elim_order(moral_graph):
-        def min_degree_node(adjacency):
-            best, best_degree = None, float("inf")
-            for node in adjacency:
-                if len(adjacency[node]) < best_degree:
-                    best, best_degree = node, len(adjacency[node])
-            return best
-
-        adjacencies = moral_graph.get_adjacencies()
-        elim_order = []
-        while len(adjacencies) > 0:
-            min_degree = min_degree_node(adjacencies)
-            adjacencies = {n: adjacencies[n] - {min_degree} for n in adjacencies if n != min_degree}
-            elim_order.append(min_degree)
-        return elim_order
     moral_graph = build_moral_graph(bnet)
-    return min_degree_elim_order(moral_graph), moral_graph
+    return elimination_order(moral_graph, bnet.get_domains(), heuristic, **options), moral_graph
 
 
-def build_junction_tree(bnet):
+def build_junction_tree(bnet, method='mst'):
     """Constructs a junction tree from a Bayesian network.
 
     YOU DO NOT NEED TO UNDERSTAND HOW THIS FUNCTION WORKS.
@@ -56,6 +274,11 @@ def build_junction_tree(bnet):
     ----------
     bnet : BayesianNetwork
         the Bayesian network
+    method : str
+        how the cliques of the elimination order are connected: 'mst' (the default)
+        takes a maximum spanning tree of the clique intersection graph, while
+        'elimination' connects each clique to the clique of its first-eliminated
+        neighbor, after dropping the cliques that are contained in another one
 
     Returns
     -------
@@ -63,30 +286,15 @@ def build_junction_tree(bnet):
         a reasonably efficient junction tree for the provided Bayesian network
     """
 
-    def elimination_cliques():
-        result = []
-        adjacencies = moral_graph.get_adjacencies()
-        for node in elim_order:
-            result.append(adjacencies[node] | {node})
-            neighbors = adjacencies[node]
-            new_adjacencies = dict()
-            for n in adjacencies:
-                if n in neighbors:
-                    new_adjacencies[n] = (adjacencies[n] - {node}) | (neighbors - {n})
-                elif n != node:
-                    new_adjacencies[n] = adjacencies[n]
-            adjacencies = new_adjacencies
-        return result
-
-    elim_order, moral_graph = compute_elimination_order(bnet)
-    cliques = elimination_cliques()
-    adjacency_matrix = np.zeros((len(cliques), len(cliques)), int)
-    for i in range(len(cliques)):
-        for j in range(i + 1, len(cliques)):
-            adjacency_matrix[i][j] = -len(cliques[i] & cliques[j])
-    mst = minimum_spanning_tree(adjacency_matrix)
-    edges = zip(mst.nonzero()[0], mst.nonzero()[1])
-    graph = UndirectedGraph(num_nodes=len(elim_order), node_labels=list(range(len(elim_order))), edges=edges)
+    elim_order, moral_graph = bnet.get_elimination_order(), bnet.get_moral_graph()
+    cliques = elimination_cliques(moral_graph, elim_order)
+    if method == 'mst':
+        edges = clique_spanning_tree(cliques)
+    elif method == 'elimination':
+        cliques, edges = elimination_clique_tree(cliques, elim_order)
+    else:
+        raise ValueError(f'Unknown junction tree method: {method}')
+    graph = UndirectedGraph(num_nodes=len(cliques), node_labels=list(range(len(cliques))), edges=edges)
     builder = JunctionTreeBuilder(graph, cliques)
     for factor in bnet.get_factors():
         builder.add_factor(factor)
@@ -94,10 +302,130 @@ def build_junction_tree(bnet):
     return prune_unlabeled_leaves(junction_tree)
 
 
+def elimination_cliques(moral_graph, elim_order):
+    """Computes the clique created by eliminating each variable of an elimination order.
+
+    Parameters
+    ----------
+    moral_graph : UndirectedGraph
+        the moral graph
+    elim_order : list[str]
+        the elimination order
+
+    Returns
+    -------
+    list[set[str]]
+        for each variable of the elimination order, the variable and its neighbors at
+        the time it is eliminated
+    """
+
+    adjacencies = {node: set(neighbors) for node, neighbors in moral_graph.get_adjacencies().items()}
+    cliques = []
+    for node in elim_order:
+        neighbors = adjacencies.pop(node)
+        cliques.append(neighbors | {node})
+        # connect the neighbors of the eliminated node to each other
+        for neighbor in neighbors:
+            adjacency = adjacencies[neighbor]
+            adjacency |= neighbors
+            adjacency.discard(neighbor)
+            adjacency.discard(node)
+    return cliques
+
+
+def clique_spanning_tree(cliques):
+    """Connects cliques by a spanning tree that maximizes the sizes of the separators.
+
+    Only pairs of cliques that share variables are considered, so the intersection
+    graph is stored sparsely (ties are broken as for a dense matrix of all pairs).
+
+    Returns
+    -------
+    list[(int, int)]
+        the edges of the spanning tree (or forest, if the cliques are not all connected)
+    """
+
+    containing = defaultdict(list)
+    for i, clique in enumerate(cliques):
+        for var in clique:
+            containing[var].append(i)
+    indptr, indices, data = [0], [], []
+    for i, clique in enumerate(cliques):
+        shared = defaultdict(int)
+        for var in clique:
+            for j in containing[var]:
+                if j > i:
+                    shared[j] += 1
+        for j in sorted(shared):
+            indices.append(j)
+            data.append(-shared[j])
+        indptr.append(len(indices))
+    intersections = csr_matrix((np.array(data, dtype=float), np.array(indices, dtype=np.int32),
+                                np.array(indptr, dtype=np.int32)), shape=(len(cliques), len(cliques)))
+    mst = minimum_spanning_tree(intersections)
+    return list(zip(mst.nonzero()[0], mst.nonzero()[1]))
+
+
+def elimination_clique_tree(cliques, elim_order):
+    """Connects the cliques of an elimination order into a tree, following the elimination.
+
+    The clique of each variable is connected to the clique of its first-eliminated
+    neighbor, and a clique contained in the clique of one of its children is replaced
+    by that child.
+
+    Returns
+    -------
+    (list[set[str]], list[(int, int)])
+        the maximal cliques (in elimination order), and the edges connecting them
+    """
+
+    position = {var: i for i, var in enumerate(elim_order)}
+    parents = [min((position[var] for var in clique if var != elim_order[i]), default=None)
+               for i, clique in enumerate(cliques)]
+    replaced_by = dict()
+    for i, parent in enumerate(parents):
+        if parent is not None and parent not in replaced_by and len(cliques[parent]) == len(cliques[i]) - 1:
+            # the parent clique is the child clique without the child's variable
+            replaced_by[parent] = i
+
+    def find(i):
+        while i in replaced_by:
+            i = replaced_by[i]
+        return i
+
+    kept = [i for i in range(len(cliques)) if i not in replaced_by]
+    renumber = {i: new for new, i in enumerate(kept)}
+    edges = []
+    for i, parent in enumerate(parents):
+        if parent is not None and find(i) != find(parent):
+            edges.append((renumber[find(i)], renumber[find(parent)]))
+    return [cliques[i] for i in kept], edges
+
+
 class UndirectedGraph:
-    """A undirected graph."""
+    """A undirected graph.
+
+    The graph can be modified in place (see add_node, add_edge and remove_node).
+    The neighbors of each node are cached as a tuple, and the sorted list of edges
+    and the message schedule are cached too, so traversals do not allocate; the caches
+    are invalidated by the in-place modifications.
+    """
+
+    def __init__(self, num_nodes, edges, node_labels=None, nodes=()):
+        """
+        Parameters
+        ----------
+        num_nodes : int
+            the number of nodes
+        edges : list[(object, object)]
+            the edges of the graph
+        node_labels : list
+            the label of each node (by default, None)
+        nodes : collection
+            nodes to include in the adjacencies even if they have no edges (e.g. the
+            variables of a moral graph)
+        """
 
-    def __init__(self, num_nodes, edges, node_labels=None):
         self.num_nodes = num_nodes
         if node_labels is None:
             node_labels = [None for _ in range(num_nodes)]
@@ -107,17 +435,30 @@ class UndirectedGraph:
             self.adjacency[node1].add(node2)
             self.adjacency[node2].add(node1)
         self.adjacency = dict(self.adjacency)
+        for node in nodes:
+            self.adjacency.setdefault(node, set())
+        self._neighbors = dict()
+        self._edges = None
+        self._schedule = None
 
     def get_neighbors(self, node):
-        return list(self.adjacency[node])
+        neighbors = self._neighbors.get(node)
+        if neighbors is None:
+            neighbors = tuple(self.adjacency.get(node, ()))
+            self._neighbors[node] = neighbors
+        return neighbors
+
+    def get_degree(self, node):
+        return len(self.adjacency.get(node, ()))
 
     def is_leaf(self, node):
-        return len(self.get_neighbors(node)) == 1
+        return len(self.adjacency.get(node, ())) == 1
 
     def are_adjacent(self, node1, node2):
         return node2 in self.adjacency[node1]
 
     def get_adjacencies(self):
+        """Returns the dictionary mapping each node to the set of its neighbors (which must not be modified)."""
         return self.adjacency
 
     def get_num_nodes(self):
@@ -126,54 +467,136 @@ class UndirectedGraph:
     def get_node_label(self, index):
         return self.node_labels[index]
 
+    def copy(self):
+        graph = UndirectedGraph(self.num_nodes, [], list(self.node_labels))
+        graph.adjacency = {node: set(neighbors) for node, neighbors in self.adjacency.items()}
+        return graph
+
     def prune_leaf(self, index):
         assert self.is_leaf(index)
-        new_edges = []
-        for (x, y) in self.get_edges():
-            if x != index and y != index:
-                new_edge = [x, y]
-                if x > index:
-                    new_edge[0] -= 1
-                if y > index:
-                    new_edge[1] -= 1
-                new_edges.append(tuple(new_edge))
-        return UndirectedGraph(self.num_nodes-1, new_edges, self.node_labels[:index] + self.node_labels[index+1:])
+        graph = self.copy()
+        graph.remove_node(index)
+        return graph
 
     def get_edges(self):
-        result = set()
-        for node in self.adjacency:
-            for neighbor in self.adjacency[node]:
-                edge = tuple(sorted([node, neighbor]))
-                result.add(edge)
-        return sorted(result)
+        if self._edges is None:
+            self._edges = sorted((node, neighbor) for node in self.adjacency
+                                 for neighbor in self.adjacency[node] if node < neighbor)
+        return list(self._edges)
 
-    def sprout_leaf(self, node, node_label=None):
+    def add_node(self, node_label=None):
+        """Adds an isolated node to the graph (in place) and returns its index."""
         new_node = self.num_nodes
-        new_edge = (new_node, node)
-        return new_node, UndirectedGraph(self.num_nodes+1,
-                                         self.get_edges() + [new_edge],
-                                         self.node_labels + [node_label])
+        self.num_nodes += 1
+        self.node_labels.append(node_label)
+        self.adjacency[new_node] = set()
+        return new_node
+
+    def add_edge(self, node1, node2):
+        """Adds an edge to the graph (in place)."""
+        self.adjacency.setdefault(node1, set()).add(node2)
+        self.adjacency.setdefault(node2, set()).add(node1)
+        self._neighbors.pop(node1, None)
+        self._neighbors.pop(node2, None)
+        self._edges = None
+        self._schedule = None
+
+    def remove_node(self, index):
+        """Removes a node and its edges from the graph (in place).
+
+        The nodes after the removed one are renumbered (i.e. their indices drop by one),
+        so the nodes remain numbered from zero, in the same relative order.
+        """
+        for neighbor in self.adjacency.pop(index, ()):
+            self.adjacency[neighbor].discard(index)
+        if index < self.num_nodes - 1:
+            shift = lambda node: node - 1 if node > index else node
+            self.adjacency = {shift(node): {shift(neighbor) for neighbor in neighbors}
+                              for node, neighbors in self.adjacency.items()}
+        self.num_nodes -= 1
+        del self.node_labels[index]
+        self._neighbors = dict()
+        self._edges = None
+        self._schedule = None
+
+    def get_message_schedule(self):
+        """Returns the order in which messages are sent over the tree (see message_passing).
+
+        Each entry is a triple (src, dest, incoming), where incoming holds the positions
+        (in the schedule) of the messages that src receives from its neighbors other
+        than dest; it is empty exactly when src is a leaf. The first node of each tree
+        is taken as its root: during the collect pass, messages flow from the leaves
+        towards the root, and during the distribute pass, they flow back from the root
+        towards the leaves, so a message always comes after its incoming messages. The
+        schedule is computed once, and cached until the graph is modified.
+        """
+        if self._schedule is None:
+            distribute = []
+            visited = [False for _ in range(self.num_nodes)]
+            for root in range(self.num_nodes):
+                if visited[root]:
+                    continue
+                visited[root] = True
+                frontier = [root]
+                while len(frontier) > 0:
+                    parent = frontier.pop()
+                    for child in self.get_neighbors(parent):
+                        if not visited[child]:
+                            visited[child] = True
+                            distribute.append((parent, child))
+                            frontier.append(child)
+            collect = [(dest, src) for (src, dest) in reversed(distribute)]
+            position = dict()
+            schedule = []
+            for (src, dest) in collect + distribute:
+                incoming = tuple(position[(neighbor, src)] for neighbor in self.get_neighbors(src)
+                                 if neighbor != dest)
+                position[(src, dest)] = len(schedule)
+                schedule.append((src, dest, incoming))
+            self._schedule = schedule
+        return self._schedule
 
+    def sprout_leaf(self, node, node_label=None):
+        graph = self.copy()
+        new_node = graph.add_node(node_label)
+        graph.add_edge(new_node, node)
+        return new_node, graph
 
     def __str__(self):
         return str(self.get_edges())
 
 
 def prune_unlabeled_leaves(jtree):
-    def first_unlabeled_leaf():
-        for node in range(result._graph.get_num_nodes()):
-            if result._graph.is_leaf(node) and len(result._factors[node]) == 0:
-                return node
-        else:
-            return None
-    result = jtree
-    prunable_leaf = first_unlabeled_leaf()
-    while prunable_leaf is not None:
-        new_graph = result._graph.prune_leaf(prunable_leaf)
-        new_factors = result._factors[:prunable_leaf] + result._factors[prunable_leaf+1:]
-        result = JunctionTree(new_graph, new_factors)
-        prunable_leaf = first_unlabeled_leaf()
-    return result
+    """Repeatedly removes the first leaf without factors, until there is none left.
+
+    The leaves are removed from a heap (a node keeps its relative position while
+    others are removed, so the first leaf is the one with the smallest original index),
+    and the remaining nodes are renumbered once at the end.
+    """
+    graph = jtree._graph
+    num_nodes = graph.get_num_nodes()
+    unlabeled = [len(jtree.get_factors(node)) == 0 for node in range(num_nodes)]
+    degrees = [graph.get_degree(node) for node in range(num_nodes)]
+    removed = [False] * num_nodes
+    leaves = [node for node in range(num_nodes) if unlabeled[node] and degrees[node] == 1]
+    heapq.heapify(leaves)
+    while len(leaves) > 0:
+        leaf = heapq.heappop(leaves)
+        if removed[leaf] or degrees[leaf] != 1:
+            continue
+        removed[leaf] = True
+        for neighbor in graph.get_neighbors(leaf):
+            if not removed[neighbor]:
+                degrees[neighbor] -= 1
+                if unlabeled[neighbor] and degrees[neighbor] == 1:
+                    heapq.heappush(leaves, neighbor)
+    if not any(removed):
+        return jtree
+    kept = [node for node in range(num_nodes) if not removed[node]]
+    renumber = {node: new for new, node in enumerate(kept)}
+    edges = [(renumber[x], renumber[y]) for (x, y) in graph.get_edges() if not removed[x] and not removed[y]]
+    new_graph = UndirectedGraph(len(kept), edges, [graph.get_node_label(node) for node in kept])
+    return JunctionTree(new_graph, [jtree.get_factors(node) for node in kept])
 
 
 
@@ -196,14 +619,20 @@ class JunctionTreeBuilder:
             possible_assignments = possible_assignments & nodeset
         assignment = list(possible_assignments)[0]
         if not self.graph.is_leaf(assignment):
-            assignment, self.graph = self.graph.sprout_leaf(assignment)
+            assignment = self.sprout_leaf(assignment)
         elif len(self.factors[assignment]) > 0:
-            assignment1, self.graph = self.graph.sprout_leaf(assignment)
+            assignment1 = self.sprout_leaf(assignment)
             self.factors[assignment1] = self.factors[assignment]
             self.factors[assignment] = []
-            assignment, self.graph = self.graph.sprout_leaf(assignment)
+            assignment = self.sprout_leaf(assignment)
         self.factors[assignment].append(factor)
 
+    def sprout_leaf(self, node):
+        """Attaches a new leaf to a node of the graph (in place) and returns the leaf."""
+        leaf = self.graph.add_node()
+        self.graph.add_edge(leaf, node)
+        return leaf
+
     def get_junction_tree(self):
         factor_list = [[] for _ in range(self.graph.get_num_nodes())]
         for i, factor in self.factors.items():